@@ -0,0 +1,276 @@
+import argparse
+import contextlib
+import datetime
+import hashlib
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from generic_helpers import date_to_epoch, fix_time, last_day_of_month
+
+# Length of the supported intervals in ms
+INTERVALS = {
+    '1m': 60_000,
+    '5m': 300_000,
+    '15m': 900_000,
+    '1h': 3_600_000,
+    '4h': 14_400_000,
+    '1d': 86_400_000
+}
+
+# A stage is reported as a regression if it is slower than the baseline by more than this factor
+DEFAULT_TOLERANCE = 1.5
+
+
+def generate_klines(n_symbols: int,
+                    periods: int,
+                    start: str = '2019-12-31',
+                    interval: str = '1d',
+                    seed: int = 0) -> Dict[str, List[list]]:
+    """
+    params:
+        n_symbols - number of synthetic cryptocurrencies
+        periods - number of klines per cryptocurrency
+        start - open date of the first kline, in format YYYY-MM-DD
+        interval - frequency of the klines, one of the INTERVALS
+        seed - seed of the random generator, the same seed always gives the same data
+
+    Deterministic synthetic klines, in the same format as the Binance API payload (see load_data).
+    Closes follow a random walk with a different drift and volatility for every symbol.
+    Returns dictionary of symbol (eg. S0001USDT) to its klines.
+    """
+    rng = random.Random(seed)
+    step = INTERVALS[interval]
+    t0 = date_to_epoch(start)
+    klines = {}
+
+    for s in range(n_symbols):
+        price = rng.uniform(0.01, 50000)
+        drift = rng.uniform(-0.001, 0.002)
+        vol = rng.uniform(0.01, 0.08)
+        rows = []
+        for p in range(periods):
+            open_price = price
+            price = max(price * (1 + rng.gauss(drift, vol)), 1e-8)
+            high = max(open_price, price) * (1 + abs(rng.gauss(0, vol / 2)))
+            low = min(open_price, price) * (1 - abs(rng.gauss(0, vol / 2)) / 2)
+            volume = rng.uniform(1e3, 1e6)
+            trades = rng.randint(100, 100000)
+            open_time = t0 + p * step
+            rows.append([open_time, f'{open_price:.8f}', f'{high:.8f}', f'{low:.8f}', f'{price:.8f}', f'{volume:.8f}',
+                         open_time + step - 1, f'{volume * price:.8f}', trades, f'{volume / 2:.8f}',
+                         f'{volume * price / 2:.8f}', '0'])
+        klines[f'S{s:04d}USDT'] = rows
+
+    return klines
+
+
+def generate_dataset(n_symbols: int,
+                     periods: int,
+                     start: str = '2019-12-31',
+                     interval: str = '1d',
+                     seed: int = 0) -> dict:
+    """
+    params:
+        n_symbols - number of synthetic cryptocurrencies
+        periods - number of klines per cryptocurrency
+        start - open date of the first kline, in format YYYY-MM-DD
+        interval - frequency of the klines, one of the INTERVALS
+        seed - seed of the random generator
+
+    Deterministic synthetic dataset in the same {ccy: {date: [...]}} format as binance_crypto_data.json,
+    built from generate_klines the same way as load_data does. Supply of every symbol is 1e6.
+    """
+    dataset = {}
+    for symbol, rows in generate_klines(n_symbols, periods, start, interval, seed).items():
+        staging_ds = {}
+        for d in rows:
+            staging_ds[fix_time(d[0])] = d[1::] + [float(d[4]) * 1e6]
+        dataset[symbol[:-4]] = staging_ds
+    return dataset
+
+
+def serve_klines(klines: Dict[str, List[list]]):
+    """
+    params:
+        klines - dictionary of symbol to its klines, eg. from generate_klines
+
+    Starts a local stub HTTP server of the klines endpoint in a background thread.
+    Returns the server (to be shut down) and the URL of the endpoint.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            q = dict(urllib.parse.parse_qsl(urllib.parse.urlparse(self.path).query))
+            start = int(q.get('startTime', 0))
+            end = int(q.get('endTime', 2 ** 62))
+            limit = int(q.get('limit', 500))
+            rows = [r for r in klines.get(q.get('symbol'), []) if start <= r[0] <= end][:limit]
+            body = json.dumps(rows).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}/api/v3/klines'
+
+
+def checksum(value) -> str:
+    """ Short hash of a JSON serializable result, floats rounded so that only real differences count """
+    def rounded(v):
+        if isinstance(v, float):
+            return round(v, 9)
+        if isinstance(v, dict):
+            return {k: rounded(x) for k, x in v.items()}
+        if isinstance(v, (list, tuple)):
+            return [rounded(x) for x in v]
+        return v
+    return hashlib.sha256(json.dumps(rounded(value), sort_keys=True).encode()).hexdigest()[:16]
+
+
+def measure(fn, *args, track_memory: bool = True, **kwargs) -> dict:
+    """
+    params:
+        fn - function to be measured
+        track_memory - track the peak memory with tracemalloc, which slows down the execution
+
+    Runs the function once and returns its result, time in seconds and peak memory in MB.
+    """
+    if track_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    seconds = time.perf_counter() - started
+    peak = 0
+    if track_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {'result': result, 'seconds': seconds, 'peak_mb': peak / 2 ** 20}
+
+
+def run_benchmarks(n_symbols: int = 20,
+                   periods: int = 520,
+                   interval: str = '1d',
+                   seed: int = 0,
+                   track_memory: bool = True) -> Dict[str, dict]:
+    """
+    params:
+        n_symbols - number of synthetic cryptocurrencies
+        periods - number of klines per cryptocurrency
+        interval - frequency of the klines, one of the INTERVALS
+        seed - seed of the random generator
+        track_memory - track the peak memory of every stage
+
+    Runs every stage of the pipeline over a synthetic dataset, fully offline.
+    Returns dictionary of stage to its time in seconds, peak memory in MB and checksum of the result.
+    """
+    # Imported here, so the synthetic data generation can be used on its own
+    from load_data import load_data
+    from kline_store import load_kline_store
+    from data_processing import get_monthly_returns_and_statistics
+    from math_helpers import rankdata, correlation
+    from returns_statistics import sharpe_ratio
+
+    report = {}
+
+    def stage(name, fn, *args, **kwargs):
+        m = measure(fn, *args, track_memory=track_memory, **kwargs)
+        report[name] = {'seconds': m['seconds'], 'peak_mb': m['peak_mb'], 'checksum': checksum(m['result'])}
+        return m['result']
+
+    klines = generate_klines(n_symbols, periods, interval=interval, seed=seed)
+    first = fix_time(klines[next(iter(klines))][0][0])
+    last = fix_time(klines[next(iter(klines))][-1][0])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        file_name = os.path.join(tmp, 'dataset.json')
+        server, url = serve_klines(klines)
+        cryptos = [[symbol[:-4], 0, 1e6] for symbol in klines]
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                stage('load_data', lambda: {ccy: records.tolist() for ccy, records in
+                                            load_data(cryptos, first, last, interval, file_name=file_name, url=url).items()})
+        finally:
+            server.shutdown()
+
+        stage('load_kline_store', lambda: load_kline_store(file_name).column('close').tolist())
+
+        # Statistics over all the full months in the data
+        start = datetime.date.fromisoformat(first)
+        end = last_day_of_month(datetime.date.fromisoformat(last))
+        if end > datetime.date.fromisoformat(last):
+            end = last_day_of_month(end.replace(day=1) - datetime.timedelta(days=1))
+        with contextlib.redirect_stdout(io.StringIO()):
+            stage('statistics', get_monthly_returns_and_statistics, str(start), str(end), file_name)
+
+    closes = [float(k[4]) for k in klines[next(iter(klines))]]
+    returns = [b / a - 1 for a, b in zip(closes, closes[1:])]
+    other = [float(k[4]) for k in klines[list(klines)[-1]]]
+    stage('rankdata', rankdata, returns)
+    stage('correlation', correlation, closes, other)
+    stage('sharpe_ratio', sharpe_ratio, returns, len(returns))
+
+    return report
+
+
+def compare(report: Dict[str, dict], baseline: Dict[str, dict], tolerance: float = DEFAULT_TOLERANCE) -> List[str]:
+    """
+    params:
+        report - result of run_benchmarks
+        baseline - result of run_benchmarks from a previous run, with the same parameters
+        tolerance - max allowed slowdown factor
+
+    Returns list of regressions - stages slower than the baseline, or with different results.
+    """
+    regressions = []
+    for name, cur in report.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if cur['checksum'] != base['checksum']:
+            regressions.append(f'{name}: result changed ({base["checksum"]} -> {cur["checksum"]})')
+        if cur['seconds'] > base['seconds'] * tolerance:
+            regressions.append(f'{name}: {cur["seconds"]:.4f}s vs. baseline {base["seconds"]:.4f}s')
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline benchmarks of the pipeline over synthetic data.')
+    parser.add_argument('--symbols', type=int, default=20, help='number of synthetic cryptocurrencies')
+    parser.add_argument('--periods', type=int, default=520, help='number of klines per cryptocurrency')
+    parser.add_argument('--interval', default='1d', choices=INTERVALS, help='frequency of the klines')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic data')
+    parser.add_argument('--no-memory', action='store_true', help='do not track the peak memory (faster)')
+    parser.add_argument('--baseline', help='JSON file with a previous report to compare with')
+    parser.add_argument('--save', help='JSON file to save the report to, eg. as a new baseline')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='max allowed slowdown factor')
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.symbols, args.periods, args.interval, args.seed, not args.no_memory)
+    for name, r in report.items():
+        print(f'{name:<20} {r["seconds"]:>10.4f}s {r["peak_mb"]:>10.2f} MB  {r["checksum"]}')
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for r in regressions:
+            print(f'REGRESSION {r}')
+        if regressions:
+            raise SystemExit(1)
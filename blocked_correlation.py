@@ -0,0 +1,186 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+import numpy as np
+from stats_engine import standardize, top_positions
+
+# Number of symbols (rows of the correlation matrix) computed at once in a single block
+DEFAULT_BLOCK = 256
+
+
+def row_offsets(n: int) -> np.ndarray:
+    """
+    params:
+        n - number of symbols
+
+    Position of the first pair (i, i + 1) of every row i in the packed upper triangle, ie. the pairs (i, j), i < j,
+    in the order of itertools.combinations(range(n), 2). The last element is the total number of pairs.
+    """
+    i = np.arange(n + 1, dtype=np.int64)
+    return i * (2 * n - i - 1) // 2
+
+
+def _blocks(n: int, block: int) -> List[Tuple[int, int]]:
+    return [(lo, min(lo + block, n)) for lo in range(0, n, block)]
+
+
+class CorrelationStore:
+    """
+    Compact on-disk store of an N x N correlation matrix - only the upper triangle without the diagonal,
+    packed row by row as float32 (N(N - 1)/2 values) and memory mapped. Symbols are kept once in a JSON
+    metadata file next to it, and pairs are identified by the symbol indexes instead of "A,B" strings.
+
+    """
+
+    def __init__(self, path: str, mode: str = 'r'):
+        """
+        params:
+            path - path of the store, without extension. Data is in path.f32 and the metadata in path.json
+            mode - memory map mode, eg. r for read only, r+ to update
+        """
+        self.path = path
+        with open(path + '.json') as f:
+            self.symbols = json.load(f)['symbols']
+        self.n = len(self.symbols)
+        self.offsets = row_offsets(self.n)
+        self.values = np.memmap(path + '.f32', dtype=np.float32, mode=mode, shape=(max(int(self.offsets[-1]), 1),))
+
+    @classmethod
+    def create(cls, path: str, symbols: List[str]) -> 'CorrelationStore':
+        """
+        params:
+            path - path of the store, without extension
+            symbols - cryptocurrency tickers in the order of the rows of the matrix
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path + '.json', 'w') as f:
+            json.dump({'symbols': list(symbols)}, f)
+        n = len(symbols)
+        np.memmap(path + '.f32', dtype=np.float32, mode='w+', shape=(max(int(row_offsets(n)[-1]), 1),)).flush()
+        return cls(path, 'r+')
+
+    def index(self, i: int, j: int) -> int:
+        """ Position of the pair of symbols with indexes i != j """
+        if i > j:
+            i, j = j, i
+        assert i != j
+        return int(self.offsets[i]) + j - i - 1
+
+    def get(self, i: int, j: int) -> float:
+        """ Correlation of the symbols with indexes i and j """
+        if i == j:
+            return 1.0
+        return float(self.values[self.index(i, j)])
+
+    def row(self, i: int) -> np.ndarray:
+        """ Correlations of symbol i with all the symbols, 1 on the diagonal """
+        out = np.empty(self.n, dtype=np.float32)
+        out[i] = 1.0
+        # Before the diagonal, the values are in column i of the previous rows
+        before = np.arange(i)
+        out[:i] = self.values[self.offsets[before] + i - before - 1]
+        out[i + 1:] = self.values[self.offsets[i]:self.offsets[i + 1]]
+        return out
+
+    def pairs(self, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """ Symbol indexes (i, j) of the pairs at positions k in the packed upper triangle """
+        k = np.asarray(k, dtype=np.int64)
+        i = np.searchsorted(self.offsets, k, side='right') - 1
+        j = k - self.offsets[i] + i + 1
+        return i, j
+
+    def top_pairs(self, k: int = 1) -> List[list]:
+        """
+        Top k most correlated pairs in the format [["A,B", corr], ...], same as stats_engine.top_correlated_pairs.
+        """
+        values = np.asarray(self.values[:int(self.offsets[-1])])
+        order = top_positions(values, k)
+        i, j = self.pairs(order)
+        return [[f'{self.symbols[a]},{self.symbols[b]}', float(values[p])] for a, b, p in zip(i, j, order)]
+
+    def flush(self) -> None:
+        self.values.flush()
+
+
+def blocked_correlations(returns: np.ndarray,
+                         symbols: List[str],
+                         path: str,
+                         block: int = DEFAULT_BLOCK,
+                         workers: int = None) -> CorrelationStore:
+    """
+    params:
+        returns - 2D array of returns, shape (symbols, periods)
+        symbols - cryptocurrency tickers in the order of the rows
+        path - path of the CorrelationStore to be created, without extension
+        block - number of rows of the matrix computed at once
+        workers - number of threads, all the CPUs by default
+
+    Computes the full correlation matrix block by block and writes the upper triangle to a CorrelationStore.
+    Blocks are computed in parallel threads (NumPy releases the GIL in the matrix products), so only
+    a few blocks of rows are in memory at any time, never the full N x N matrix.
+    """
+    z = standardize(returns)
+    n = len(symbols)
+    store = CorrelationStore.create(path, symbols)
+    offsets = store.offsets
+
+    def compute(lo, hi):
+        # Only the columns after the first row of the block are needed for the upper triangle
+        corr = (z[lo:hi] @ z[lo:].T).astype(np.float32)
+        for i in range(lo, hi):
+            store.values[offsets[i]:offsets[i + 1]] = corr[i - lo, i - lo + 1:]
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        for future in [executor.submit(compute, lo, hi) for lo, hi in _blocks(n, block)]:
+            future.result()
+
+    store.flush()
+    return store
+
+
+def filtered_correlations(returns: np.ndarray,
+                          threshold: float = None,
+                          top_k: int = None,
+                          block: int = DEFAULT_BLOCK,
+                          workers: int = None) -> List[Tuple[int, int, float]]:
+    """
+    params:
+        returns - 2D array of returns, shape (symbols, periods)
+        threshold - keep only the pairs with correlation >= threshold
+        top_k - keep only the top k most correlated pairs of every symbol
+        block - number of rows of the matrix computed at once
+        workers - number of threads, all the CPUs by default
+
+    Sparse version of the correlation matrix - computed block by block in parallel, keeping only the pairs
+    passing the filters. Returns list of (i, j, corr) with the symbol indexes i < j, sorted by i and j.
+    With top_k a pair is kept if it is in the top k of either of its symbols.
+    """
+    assert threshold is not None or top_k is not None
+    z = standardize(returns)
+    n = z.shape[0]
+
+    def compute(lo, hi):
+        corr = z[lo:hi] @ z.T
+        rows = np.arange(lo, hi)
+        corr[rows - lo, rows] = -np.inf
+        keep = np.ones(corr.shape, dtype=bool)
+        if threshold is not None:
+            keep &= corr >= threshold
+        if top_k is not None and top_k < n - 1:
+            top = np.zeros(corr.shape, dtype=bool)
+            np.put_along_axis(top, np.argpartition(-corr, top_k - 1, axis=1)[:, :top_k], True, axis=1)
+            keep &= top
+        keep[rows - lo, rows] = False
+        i, j = np.nonzero(keep)
+        return i + lo, j, corr[i, j]
+
+    pairs = {}
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        for future in [executor.submit(compute, lo, hi) for lo, hi in _blocks(n, block)]:
+            for i, j, c in zip(*[x.tolist() for x in future.result()]):
+                pairs[(min(i, j), max(i, j))] = c
+
+    return [(i, j, pairs[(i, j)]) for i, j in sorted(pairs)]
@@ -0,0 +1,120 @@
+import datetime
+from functools import lru_cache
+import numpy as np
+
+MS_PER_DAY = 86_400_000
+
+EPOCH = datetime.date(1970, 1, 1)
+
+
+def day_offsets(open_time: np.ndarray) -> np.ndarray:
+    """
+    params:
+        open_time - epoch times in ms (UTC)
+
+    Day of every open time as an integer offset from 1970-01-01 (UTC).
+    """
+    return np.asarray(open_time, dtype=np.int64) // MS_PER_DAY
+
+
+def month_offsets(open_time: np.ndarray) -> np.ndarray:
+    """
+    params:
+        open_time - epoch times in ms (UTC)
+
+    Month of every open time as an integer offset from 1970-01 (UTC).
+    """
+    return np.asarray(open_time, dtype=np.int64).astype('datetime64[ms]').astype('datetime64[M]').astype(np.int64)
+
+
+@lru_cache(maxsize=None)
+def day_key(day: int) -> str:
+    """
+    params:
+        day - day offset from 1970-01-01
+
+    Date of the day in format YYYY-MM-DD. Memoized, so every day is formatted only once.
+    """
+    return (EPOCH + datetime.timedelta(days=day)).isoformat()
+
+
+def epoch_to_date(epoch_num: int) -> str:
+    """
+    params:
+        epoch_num - epoch time in ms
+
+    Date (UTC) of the epoch time in format YYYY-MM-DD, the same on every machine whatever its local timezone.
+    """
+    return day_key(int(epoch_num) // MS_PER_DAY)
+
+
+def date_keys(open_time: np.ndarray) -> np.ndarray:
+    """
+    params:
+        open_time - epoch times in ms (UTC)
+
+    Dates of all the open times in format YYYY-MM-DD, formatted once per distinct day.
+    """
+    days, inverse = np.unique(day_offsets(open_time), return_inverse=True)
+    return np.datetime_as_string(days.astype('datetime64[D]'), unit='D')[inverse]
+
+
+def month_end_dates(start: datetime.date, end: datetime.date, last_date: datetime.date = None) -> np.ndarray:
+    """
+    params:
+        start - begin of the interval
+        end - end of the interval
+        last_date - optional last day fully covered by the data, month ends after it are dropped
+
+    All the month ends from the month of start to the month of end, both included, as datetime64[D] -
+    the first one is the previous month end of the first 1M return. Empty if both are in the same month.
+    With last_date, a month the data ends partway through is dropped, instead of being labeled with its month end.
+    """
+    first = np.datetime64(start, 'M')
+    last = np.datetime64(end, 'M')
+    if last <= first:
+        return np.array([], dtype='datetime64[D]')
+    dates = (np.arange(first, last + 1) + 1).astype('datetime64[D]') - 1
+    return dates if last_date is None else dates[dates <= np.datetime64(last_date, 'D')]
+
+
+class CalendarIndex:
+    """
+    Calendar of a sorted open time axis, computed once - the day offset of every open time,
+    so the first/last dates and the last candle of every day are array indexing, instead of formatting and parsing dates.
+
+    """
+
+    def __init__(self, open_time: np.ndarray):
+        """
+        params:
+            open_time - sorted open times of the candles, epoch in ms (UTC)
+        """
+        self.open_time = np.asarray(open_time, dtype=np.int64)
+        self.days = day_offsets(self.open_time)
+
+    def __len__(self) -> int:
+        return len(self.open_time)
+
+    @property
+    def first_date(self) -> datetime.date:
+        return EPOCH + datetime.timedelta(days=int(self.days[0]))
+
+    @property
+    def last_date(self) -> datetime.date:
+        return EPOCH + datetime.timedelta(days=int(self.days[-1]))
+
+    @property
+    def last_full_date(self) -> datetime.date:
+        """
+        Last day fully covered by the candles, ie. the last candle closes at its end. The candles are taken
+        as long as the shortest step between the open times (a day if there is only one), eg. with 1h candles
+        ending on the 00:00 one of a day, the last full day is the one before.
+        """
+        step = int(np.diff(self.open_time).min()) if len(self.open_time) > 1 else MS_PER_DAY
+        close = int(self.open_time[-1]) + step
+        return EPOCH + datetime.timedelta(days=close // MS_PER_DAY - 1)
+
+    def last_of_day(self) -> np.ndarray:
+        """ Position of the last candle of every day with candles, eg. the daily close of 1h candles """
+        return np.flatnonzero(np.diff(self.days, append=np.iinfo(np.int64).max))
@@ -0,0 +1,208 @@
+import argparse
+import datetime
+import os
+import sys
+from typing import List
+
+# Only the standard library is imported up front. Every command imports what it needs by itself,
+# so eg. an offline stats run never loads requests, and nothing is loaded for --help.
+
+DEFAULT_FILE = 'binance_crypto_data.json'
+DEFAULT_STORE = 'binance_crypto_data.npz'
+
+
+def today() -> str:
+    """ Current date (UTC) in format YYYY-MM-DD """
+    return datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d')
+
+
+def local_file(file_name: str) -> str:
+    """
+    params:
+        file_name - file given with --file, empty for the default
+
+    The file given, otherwise the KlineStore if one is saved, falling back to the JSON dataset shipped with the repo.
+    """
+    if file_name:
+        return file_name
+    return DEFAULT_STORE if os.path.exists(DEFAULT_STORE) else DEFAULT_FILE
+
+
+def universe(args: argparse.Namespace) -> list:
+    """
+    Top N cryptocurrencies by market cap - the current ones, or the ones as of the --as-of date from the products snapshots.
+    """
+    from generic_helpers import get_top_cryptoccy_as_of, get_top_cryptoccy_by_market_cap
+
+    if args.as_of:
+        return get_top_cryptoccy_as_of(datetime.date.fromisoformat(args.as_of), args.top, args.snapshot_dir)
+    return get_top_cryptoccy_by_market_cap(args.top, snapshot_dir=args.snapshot_dir)
+
+
+def fetch(args: argparse.Namespace) -> None:
+    """
+    Downloads the klines of the top N cryptocurrencies by market cap to the JSON dataset and the KlineStore.
+    """
+    from load_data import load_data
+    from instrumentation import logger
+
+    cryptos = universe(args)
+    logger.info(cryptos)
+    load_data(cryptos, args.start, args.end, args.interval, args.limit, args.file, args.store, args.workers,
+              snapshot_dir=args.snapshot_dir)
+
+
+def update(args: argparse.Namespace) -> None:
+    """
+    Appends only the new klines of the top N cryptocurrencies to the KlineCache, and optionally rebuilds the KlineStore from it.
+    """
+    from generic_helpers import date_to_epoch, fix_time
+    from kline_cache import KlineCache
+    from instrumentation import logger, stage
+
+    cryptos = universe(args)
+    cache = KlineCache(args.cache_dir)
+    with stage('download'):
+        appended = cache.refresh([ccy + 'USDT' for ccy, _, _ in cryptos], args.interval, date_to_epoch(args.start),
+                                 max_workers=args.workers)
+    for symbol, n in appended.items():
+        logger.info(f'{symbol}: {n} new klines')
+        # Gaps (eg. exchange downtime) and overlaps are reported, the cache is not changed
+        problems = cache.validate(symbol, args.interval)
+        for kind, found in problems.items():
+            if found:
+                logger.warning(f'{symbol}: {len(found)} {kind} in the cached klines, first after {fix_time(found[0][0])}')
+
+    if args.store:
+        with stage('save'):
+            cache.to_store(cryptos, args.interval, snapshot_dir=args.snapshot_dir).save(args.store)
+        logger.info(f'Kline store {args.store} saved on FS.')
+
+
+def stats(args: argparse.Namespace) -> None:
+    """
+    Monthly returns, Sharpe & Sortino Ratios, rank correlations and pairs' correlations from a local file.
+    """
+    from data_processing import get_monthly_returns_and_statistics
+
+    get_monthly_returns_and_statistics(args.start, args.end, local_file(args.file), not args.no_save, args.workers,
+                                       args.correlations_dir, args.format, args.output_dir)
+
+
+def correlations(args: argparse.Namespace) -> None:
+    """
+    Pairs' correlations of the period returns from a local file, written to a CorrelationStore.
+    """
+    import numpy as np
+    from blocked_correlation import blocked_correlations
+    from calendar_index import MS_PER_DAY
+    from generic_helpers import date_to_epoch
+    from kline_store import load_kline_store
+    from resample import resample
+    from stats_engine import period_returns
+    from instrumentation import logger, stage
+
+    store = load_kline_store(local_file(args.file), fields=('close',))
+    # Both the start and the end date are included
+    lo, hi = np.searchsorted(store.open_time, [date_to_epoch(args.start), date_to_epoch(args.end) + MS_PER_DAY])
+    closes = resample(store.open_time[lo:hi], {'close': store.column('close')[:, lo:hi]}, args.period)['close']
+    returns = period_returns(closes)
+    if returns.shape[1] < 2:
+        raise ValueError('At least 2 periods of returns are needed for the correlations.')
+    if np.isnan(returns).any():
+        missing = sorted({store.symbols[i] for i in np.flatnonzero(np.isnan(returns).any(axis=1))})
+        raise ValueError(f'No data available for some of the periods for: {", ".join(missing)}')
+
+    path = os.path.join(args.output_dir, f'{args.end}-{args.period}')
+    with stage('correlations'):
+        corr_store = blocked_correlations(returns, store.symbols, path, args.block, args.workers)
+    logger.info(f'Correlations of {len(store.symbols)} symbols over {returns.shape[1]} periods saved to {path}')
+    for pair in corr_store.top_pairs(args.top_pairs):
+        logger.info(pair)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='Binance crypto data - download the klines and compute the statistics.')
+    parser.add_argument('--quiet', action='store_true', help='no progress output, only errors')
+    parser.add_argument('--metrics', choices=('json', 'prometheus'), default=os.environ.get('BINANCE_DATA_METRICS') or None,
+                        help='print the stage timers and counters at the end (default from BINANCE_DATA_METRICS)')
+    parser.add_argument('--memory', action='store_true', help='track the peak memory of every stage, with --metrics')
+    parser.add_argument('--profile', default='', help='comma separated stages to be profiled with cProfile, eg. download,statistics')
+    parser.add_argument('--profile-dir', default='', help='directory for the .prof files, otherwise part of the metrics')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def universe_args(p):
+        p.add_argument('--top', type=int, default=20, help='number of top cryptocurrencies by market cap')
+        p.add_argument('--interval', default='1d', help='frequency of the klines, eg. 1d, 1h')
+        p.add_argument('--start', required=True, help='begin of interval, YYYY-MM-DD')
+        p.add_argument('--workers', type=int, default=8, help='max number of concurrent requests')
+        p.add_argument('--snapshot-dir', default='snapshots',
+                       help='directory with the products snapshots, also used for the historical supply of the market caps')
+        p.add_argument('--as-of', default='', help='take the top cryptocurrencies as of this date (YYYY-MM-DD) from the snapshots')
+
+    p = commands.add_parser('fetch', help='download the klines of the top cryptocurrencies')
+    universe_args(p)
+    p.add_argument('--end', default=today(), help='end of interval, YYYY-MM-DD, today by default')
+    p.add_argument('--limit', type=int, default=1000, help='page size of the requests, at most 1000 (the API limit)')
+    p.add_argument('--file', default=DEFAULT_FILE, help='JSON dataset to be saved')
+    p.add_argument('--store', default=DEFAULT_STORE, help='KlineStore (.npz) to be saved as well, empty to skip')
+    p.set_defaults(func=fetch)
+
+    p = commands.add_parser('update', help='append only the new klines to the local cache')
+    universe_args(p)
+    p.add_argument('--cache-dir', default='kline_cache', help='directory of the KlineCache')
+    p.add_argument('--store', default='', help='KlineStore (.npz) to be rebuilt from the cache')
+    p.set_defaults(func=update)
+
+    def local(p):
+        p.add_argument('--file', default='',
+                       help=f'KlineStore (.npz) or JSON dataset, {DEFAULT_STORE} if it exists, otherwise {DEFAULT_FILE}')
+        p.add_argument('--start', required=True, help='begin of interval, YYYY-MM-DD')
+        p.add_argument('--end', required=True, help='end of interval, YYYY-MM-DD')
+
+    p = commands.add_parser('stats', help='monthly statistics and correlations from a local file')
+    local(p)
+    p.add_argument('--workers', type=int, default=1, help='number of processes for the statistics')
+    p.add_argument('--format', default='json', choices=('json', 'parquet', 'csv'), help='format of the saved results')
+    p.add_argument('--output-dir', default='results', help='output directory for the parquet/csv formats')
+    p.add_argument('--correlations-dir', default='', help='directory for the blocked correlations of large universes')
+    p.add_argument('--no-save', action='store_true', help='only print the results')
+    p.set_defaults(func=stats)
+
+    p = commands.add_parser('correlations', help='pairs\' correlations of the period returns from a local file')
+    local(p)
+    p.add_argument('--period', default='M', help='W, M, Q, Y or Nd, eg. 7d')
+    p.add_argument('--workers', type=int, default=None, help='number of threads, all the CPUs by default')
+    p.add_argument('--block', type=int, default=256, help='number of rows of the matrix computed at once')
+    p.add_argument('--output-dir', default='correlations', help='directory of the CorrelationStore')
+    p.add_argument('--top-pairs', type=int, default=1, help='number of the most correlated pairs to be printed')
+    p.set_defaults(func=correlations)
+
+    return parser
+
+
+def main(argv: List[str] = None) -> None:
+    """
+    params:
+        argv - command line arguments, sys.argv by default
+    """
+    args = build_parser().parse_args(argv)
+
+    import logging
+    from instrumentation import logger, metrics
+
+    logger.setLevel(logging.WARNING if args.quiet else logging.INFO)
+    if args.metrics:
+        metrics.reset()
+        metrics.enable(args.memory, [s for s in args.profile.split(',') if s], args.profile_dir)
+
+    try:
+        args.func(args)
+    finally:
+        if args.metrics:
+            metrics.disable()
+            sys.stdout.write(metrics.to_prometheus() if args.metrics == 'prometheus' else metrics.to_json() + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,21 +1,40 @@
 import datetime
 import json 
-from itertools import combinations
+import logging
+import os
 from typing import Type
-from generic_helpers import gen_dates_interval, last_day_of_month
-from returns_statistics import sharpe_ratio, sortino_ratio
-from math_helpers import correlation, rankdata
+import numpy as np
+from calendar_index import month_end_dates
+from kline_store import load_kline_store
+from resample import period_closes
+from blocked_correlation import blocked_correlations
+from results_writer import ResultWriter
+from stats_engine import monthly_statistics, correlation_matrix, pair_correlations, top_correlated_pairs
+from instrumentation import logger, stage
 
 def get_monthly_returns_and_statistics(start: str, 
                         end: str, 
                         file_name:str = '', 
-                        save:bool = False) -> dict:
+                        save:bool = False,
+                        workers:int = 1,
+                        correlations_dir:str = '',
+                        output_format:str = 'json',
+                        output_dir:str = 'results') -> dict:
     """
     params:
         start - begin of interval for 1M returns to compute, in format YYYY-MM-DD
         end - end of interval for 1M returns to compute, in format YYYY-MM-DD
         file_name - source file name. Should in the same (./) directory.
+                    Either the binary .npz KlineStore or the JSON dataset from load_data.
         save - save the 1M returns to a file on the file system.
+        workers - number of processes the cryptocurrencies are sharded across, 1 to compute everything in this one.
+        correlations_dir - optional directory for large universes. If given, the pairs' returns correlations
+                           of every month are written block by block to a compact CorrelationStore in there,
+                           and the path of the store is kept in the output instead of the list of all pairs.
+        output_format - format of the saved results - json for the 2 JSON files, or parquet/csv for the columnar
+                        ResultWriter, streaming the results month by month to output_dir
+                        (the paths of the correlations files are returned instead of the lists of all pairs).
+        output_dir - output directory for the parquet/csv formats.
         
     Compute the monthly returns for a given group of entities/cryptocurriencies from an input file.
     Output file with the 1M month returns is to be output and possible to be saved locally on the FS.
@@ -24,8 +43,8 @@ def get_monthly_returns_and_statistics(start: str,
     if file_name == '':
         raise ValueError('Please specify valid and existing file name.')
 
-    with open(file_name) as f:
-        ds = json.load(f)
+    # Only the fields needed for the statistics are loaded
+    store = load_kline_store(file_name, fields=('close', 'market_cap'))
     
     start = start.split('-')
     end = end.split('-')
@@ -40,98 +59,110 @@ def get_monthly_returns_and_statistics(start: str,
     start = datetime.datetime(int(start[0]),int(start[1]),int(start[2])).date()
     end = datetime.datetime(int(end[0]),int(end[1]),int(end[2])).date()
         
-    if start < datetime.date(2019, 12, 31):
-        raise ValueError('Invalid start date provided. Start date must be >= 2019-12-31!')
+    # Bounds are the ones of the loaded data
+    if len(store.open_time) == 0:
+        raise ValueError('No data found in the file provided.')
+    first_date = store.calendar.first_date
+    last_date = store.calendar.last_date
 
-    if end > datetime.date(2021, 5, 31):
-        raise ValueError('Invalid end date provided. End date must be <= 2021-05-31!')
+    if start < first_date:
+        raise ValueError(f'Invalid start date provided. Start date must be >= {first_date}!')
+
+    if end > last_date:
+        raise ValueError(f'Invalid end date provided. End date must be <= {last_date}!')
     
-    month_returns = {}
-    market_cap_series = {}
-    rank_corr_coef_results = {}
+    # All month ends as of which we compute the 1M returns, first one is the previous month end of the first month.
+    # Computed at once as an array and formatted only once, for the keys of the output.
+    # A month the data ends partway through (eg. end is today, or the intraday candles stop early on the month end day)
+    # has no month end close yet, so it is left out.
+    last_full_date = store.calendar.last_full_date
+    month_end_days = month_end_dates(start, end, last_full_date)
+    if len(month_end_days) < len(month_end_dates(start, end)):
+        if len(month_end_days) < 2:
+            raise ValueError(f'No full month of data available between {start} and {last_full_date}!')
+        logger.warning(f'Data is complete up to {last_full_date}, the returns are computed up to the last full month - {month_end_days[-1]}.')
+    dates = np.datetime_as_string(month_end_days, unit='D').tolist()
+
+    # Month end closes are resampled from the loaded data, with the last available close in the month,
+    # so missing days are not a problem. Only a cryptocurrency with no data at all before a month end is.
+    month_end = period_closes(store, month_end_days, 'M', ('close', 'market_cap'))
+    month_end_closes = month_end['close']
+    if np.isnan(month_end_closes).any():
+        missing = sorted({store.symbols[i] for i in np.flatnonzero(np.isnan(month_end_closes).any(axis=1))})
+        raise ValueError(f'No data available as of some of the month ends for: {", ".join(missing)}')
+
+    # Returns, Sharpe & Sortino ratios and the rank correlations (market cap vs. return)
+    # are computed at once for all the cryptocurrencies and months.
+    # Results match the ones from sharpe_ratio, sortino_ratio and correlation(rankdata(...)).
+    # With more workers, the cryptocurrencies are sharded across a process pool, sharing the prices through shared memory.
+    with stage('statistics'):
+        if workers > 1:
+            # Imported only when needed, multiprocessing is not for free
+            from parallel_stats import parallel_monthly_statistics
+            stats = parallel_monthly_statistics(month_end_closes, month_end['market_cap'], workers=workers)
+        else:
+            stats = monthly_statistics(month_end_closes, month_end['market_cap'])
+
     all_correlations = {}
     all_stats = {}
-    
-    for d in gen_dates_interval(start, end, datetime.timedelta(days=1)):
-        prev_month_end = d.strftime('%Y-%m-%d')
-        cur_month_end = last_day_of_month((d + datetime.timedelta(days=1))).strftime('%Y-%m-%d')
-        
-        for ccy in ds.keys():
-            if ccy not in month_returns:
-                month_returns[ccy] = []
-            # Index is 3, since we moved the date outside of the data list
-            try:
-                a = float(ds.get(ccy).get(cur_month_end)[3])
-                b = float(ds.get(ccy).get(prev_month_end)[3])
-            except TypeError:
-                raise TypeError('Something gone wrong when hitting a dictionary index. Check Dates!')
-            if (not a or not b):
-                break
-            
-            # Pretty much a simple arithmetic return calculation
-            current_return = (a/b)-1
-            # Because of how we iterate those should be always in ascending order
-            # TODO: check for this...
-            month_returns[ccy].append(current_return)
-
-            # Sharpe and Sortino ratios calculated in here
-            try:
-                sharpe = sharpe_ratio(month_returns[ccy], len(month_returns[ccy]))
-            except AssertionError:
-                sharpe = 0
-                
-            try:
-                sortino = sortino_ratio(month_returns[ccy], len(month_returns[ccy]))
-            except AssertionError:
-                sortino = 0
-
-            # Rank correlation starting in here
-            # Custom functions used, but the final results verified against
-            # scipy.stats.spearmanr and give pretty much the same results
-            if ccy not in market_cap_series:
-                market_cap_series[ccy] = []
-            if ccy not in rank_corr_coef_results:
-                rank_corr_coef_results[ccy] = []
-            
-            mk = float(ds.get(ccy).get(cur_month_end)[-1])
-            market_cap_series[ccy].append(mk)
-
-            ranked_returns = rankdata(month_returns[ccy])
-            ranked_market_cap = rankdata(market_cap_series[ccy])
-            try:
-                rank_corr_coef = correlation(ranked_returns, ranked_market_cap)
-            except AssertionError:
-                rank_corr_coef = 0
-            
-            rank_corr_coef_results[ccy].append(rank_corr_coef)
-            
+
+    # Columnar results are written month by month, while iterating
+    writer = None
+    if save and output_format != 'json':
+        writer = ResultWriter(output_dir, store.symbols, output_format)
+
+    # The per symbol lines are not even formatted, unless the logger is enabled for them
+    verbose = logger.isEnabledFor(logging.INFO)
+
+    for m in range(len(dates) - 1):
+        prev_month_end = dates[m]
+        cur_month_end = dates[m + 1]
+
+        all_stats[cur_month_end] = []
+        if writer is not None:
+            writer.write_stats(cur_month_end, stats['returns'][:, m], stats['sharpe'][:, m],
+                               stats['sortino'][:, m], stats['rank_corr'][:, m])
+
+        for ccy, i in store.symbol_index.items():
+            current_return = float(stats['returns'][i, m])
+            sharpe = float(stats['sharpe'][i, m])
+            sortino = float(stats['sortino'][i, m])
+            rank_corr_coef = float(stats['rank_corr'][i, m])
+
             # Add all the monthly data for the current crypto in a mutual dataset to be returned later
-            all_stats[cur_month_end] = [ccy, current_return, sharpe, sortino, rank_corr_coef]
-            print(f'1M Return for: {prev_month_end}, {cur_month_end}, {ccy}, {current_return}, Sharpe Ratio = {sharpe}, Sortino Ratio = {sortino}, Rank corr. coef (market cap vs. return) = {rank_corr_coef}')
-
-
-        # Correlation between the pairs' returns starting in here        
-        pairs = [",".join(map(str, comb)) for comb in combinations(month_returns.keys(), 2)]
-        if pairs:
-            all_correlations[cur_month_end] = []
-            for pair in pairs:
-                a = pair.split(',')[0]
-                b = pair.split(',')[1]
-                try:
-                    corr = correlation(month_returns[a], month_returns[b])
-                    all_correlations[cur_month_end].append([pair, corr])
-                except:
-                    corr = 0.0
-                    all_correlations[cur_month_end].append([pair, corr])
-         
-        print(f'Pair with max correlation as of {cur_month_end}: {sorted(all_correlations[cur_month_end], key = lambda x:x[1], reverse = True)[0]}')
+            all_stats[cur_month_end].append([ccy, current_return, sharpe, sortino, rank_corr_coef])
+            if verbose:
+                logger.info(f'1M Return for: {prev_month_end}, {cur_month_end}, {ccy}, {current_return}, Sharpe Ratio = {sharpe}, Sortino Ratio = {sortino}, Rank corr. coef (market cap vs. return) = {rank_corr_coef}')
+
+
+        # Correlation between the pairs' returns starting in here
+        if correlations_dir:
+            # The full matrix is never kept in memory, only the upper triangle is written to disk in float32
+            path = os.path.join(correlations_dir, cur_month_end)
+            with stage('correlations'):
+                corr_store = blocked_correlations(stats['returns'][:, :m + 1], store.symbols, path, workers=workers)
+            all_correlations[cur_month_end] = path
+            logger.info(f'Pair with max correlation as of {cur_month_end}: {corr_store.top_pairs(1)[0]}')
+            continue
+
+        # Full correlation matrix as of the current month, computed at once for all the pairs
+        with stage('correlations'):
+            corr = correlation_matrix(stats['returns'][:, :m + 1])
+            if len(store.symbols) > 1:
+                if writer is not None:
+                    # Already on disk, so only the path is kept instead of the list of all pairs
+                    all_correlations[cur_month_end] = writer.write_correlations(cur_month_end, corr)
+                else:
+                    all_correlations[cur_month_end] = pair_correlations(corr, store.symbols)
+
+        logger.info(f'Pair with max correlation as of {cur_month_end}: {top_correlated_pairs(corr, store.symbols, 1)[0]}')
 
     # If save option is enabled all results are saved to the FS
     # 2 files are output, both in JSON format,
     # first one has all monthly based statistics and the second one has all the
     # pairs' returns correlations
-    if save:
-        with open('all_stats.json', 'w') as f0, open('pairs_returns_correlations.json', 'w') as f1:
+    if save and writer is None:
+        with stage('save'), open('all_stats.json', 'w') as f0, open('pairs_returns_correlations.json', 'w') as f1:
             json.dump(all_stats, f0)
             json.dump(all_correlations, f1)
 
@@ -1,68 +1,203 @@
-import requests
+import heapq
 import json
-from typing import List
+import os
+import time
+from typing import Dict, Iterator, List, Tuple
 import datetime
+from calendar_index import epoch_to_date
+from instrumentation import incr, stage
 
-def get_top_cryptoccy_by_market_cap(n:int = 20) -> List[list]:
+PRODUCTS_URL = "https://www.binance.com/exchange-api/v2/public/asset-service/product/get-products"
+
+# Products snapshots younger than this (in seconds) are used instead of downloading the products again
+SNAPSHOT_TTL = 24 * 60 * 60
+
+
+def download_products() -> dict:
+    """
+    Downloads the products payload, which has the prices and the supply of all the products.
+    """
+    # Imported only here, so that nothing offline (eg. the statistics from a local file) pays for it
+    import requests
+
+    incr('http_requests')
+    res = requests.get(PRODUCTS_URL, verify=False)
+    incr('http_bytes', len(res.content))
+    if res.status_code != 200:
+        raise Exception(f'Something went wrong with the GET request. MSG: {res.text}')
+
+    return json.loads(res.text)
+
+
+def list_snapshots(snapshot_dir:str) -> List[tuple]:
     """
     params:
-        n - number of top crypto currencies by market cap to be extracted
-    
-    Extracts cryptocurrency tickers, by market cap, taking the top "n".
-    For some reason the market cap is not that easy to find with the Binance API.
-    This is a custom function on how to get top(n) crytocurrencies, compared on their market cap.
+        snapshot_dir - directory with the products snapshots
     
+    All the products snapshots as (epoch time in seconds, file path), sorted by time.
     """
+    if not os.path.isdir(snapshot_dir):
+        return []
+    snapshots = []
+    for f in os.listdir(snapshot_dir):
+        if f.startswith('products-') and f.endswith('.json'):
+            snapshots.append((int(f[len('products-'):-len('.json')]), os.path.join(snapshot_dir, f)))
+    return sorted(snapshots)
 
-    # Define to have at least 1 crypto to be extracted
-    assert n > 0
 
-    url = "https://www.binance.com/exchange-api/v2/public/asset-service/product/get-products"
-    res = requests.get(url, verify=False)
-    if res.status_code != 200:
-        raise Exception(f'Something went wrong with the GET request. MSG: {res.text}')
+def save_snapshot(snapshot_dir:str, payload:dict, timestamp:int = None) -> str:
+    """
+    params:
+        snapshot_dir - directory with the products snapshots
+        payload - products payload
+        timestamp - epoch time in seconds of the snapshot, now by default
+    
+    Saves a timestamped snapshot of the products payload. Older snapshots are kept, so that the universe can be
+    reconstructed as of past dates.
+    """
+    os.makedirs(snapshot_dir, exist_ok=True)
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    path = os.path.join(snapshot_dir, f'products-{timestamp}.json')
+    with open(path, 'w') as f:
+        json.dump(payload, f)
+    return path
 
-    res_json = json.loads(res.text)
+
+def get_products(snapshot_dir:str = '', ttl:int = SNAPSHOT_TTL) -> dict:
+    """
+    params:
+        snapshot_dir - directory with the products snapshots, no snapshots are used if empty
+        ttl - max age in seconds of a snapshot to be used instead of downloading the products again
     
-    crypto_ccys = []
+    Products payload - from the latest snapshot if that is recent enough, otherwise downloaded and saved as a new snapshot.
+    """
+    if not snapshot_dir:
+        return download_products()
+
+    snapshots = list_snapshots(snapshot_dir)
+    if snapshots and time.time() - snapshots[-1][0] < ttl:
+        incr('snapshot_hits')
+        with open(snapshots[-1][1]) as f:
+            return json.load(f)
+
+    incr('snapshot_misses')
+    payload = download_products()
+    save_snapshot(snapshot_dir, payload)
+    return payload
+
+
+def usdt_products(products:dict) -> Iterator[list]:
+    """
+    params:
+        products - products payload
     
-    for item in res_json.get('data'):
+    All the USDT products with a known supply, as [ticker, market cap, supply].
+    """
+    for item in products.get('data'):
         pair = item.get('s')
-        if pair:
-            if pair[-4:] != 'USDT':
-                continue
-        else:
+        if not pair or pair[-4:] != 'USDT':
             continue
-            
-        ticker = item.get('b')
-        current_price = float(item.get('c'))
         supply = item.get('cs')
-        if supply:
-            supply = float(supply)
-        else:
+        if not supply:
             continue
-        
-        market_cap = supply*current_price
-        crypto_ccys.append([ticker, market_cap, supply])
-        
-        # Python's default sorting should work not that bad for this case. 
-        crypto_ccys = sorted(crypto_ccys, key = lambda x:x[1], reverse = True)[:n]
+        supply = float(supply)
+        yield [item.get('b'), supply*float(item.get('c')), supply]
+
+
+def top_cryptoccy_by_market_cap(products:dict, n:int = 20) -> List[list]:
+    """
+    params:
+        products - products payload
+        n - number of top crypto currencies by market cap to be extracted
     
+    Top "n" USDT products by market cap as [ticker, market cap, supply].
+    Partial selection with a heap - O(P log n) over the P products, no full sort.
+    Ties keep the order of the products, same as a stable sort.
+    """
+    # Define to have at least 1 crypto to be extracted
+    assert n > 0
+    return heapq.nlargest(n, usdt_products(products), key = lambda x:x[1])
+
+
+def get_top_cryptoccy_by_market_cap(n:int = 20, snapshot_dir:str = '', ttl:int = SNAPSHOT_TTL) -> List[list]:
+    """
+    params:
+        n - number of top crypto currencies by market cap to be extracted
+        snapshot_dir - directory with the products snapshots, no snapshots are used if empty
+        ttl - max age in seconds of a snapshot to be used instead of downloading the products again
+    
+    Extracts cryptocurrency tickers, by market cap, taking the top "n".
+    For some reason the market cap is not that easy to find with the Binance API.
+    This is a custom function on how to get top(n) crytocurrencies, compared on their market cap.
+    
+    """
     # Returning full data - with the market cap and supply included included in the format of a nested list.
     # Supply can be accessed and worked with further so that we calculate market cap using different prices.
-    # Also returning the cryptocurrencies names only in list format, so that can be passed easily further
-    # return crypto_ccys, [x[0] for x in crypto_ccys]
-    return crypto_ccys
+    with stage('universe'):
+        return top_cryptoccy_by_market_cap(get_products(snapshot_dir, ttl), n)
+
+
+def get_top_cryptoccy_as_of(date:datetime.date, n:int = 20, snapshot_dir:str = 'snapshots') -> List[list]:
+    """
+    params:
+        date - date as of which the universe is reconstructed, eg. a month end
+        n - number of top crypto currencies by market cap to be extracted
+        snapshot_dir - directory with the products snapshots
+    
+    Top "n" crypto currencies by market cap from the latest snapshot taken by the end of the date (UTC),
+    so the membership and the supply are the ones known at that time, not today's ones.
+    """
+    end_of_day = datetime.datetime(date.year, date.month, date.day, tzinfo=datetime.timezone.utc) + datetime.timedelta(days=1)
+    snapshots = [s for s in list_snapshots(snapshot_dir) if s[0] < end_of_day.timestamp()]
+    if not snapshots:
+        raise ValueError(f'No products snapshot available as of {date}.')
+
+    with open(snapshots[-1][1]) as f:
+        return top_cryptoccy_by_market_cap(json.load(f), n)
+
+
+def supply_history(snapshot_dir:str, tickers:List[str]) -> Dict[str, Tuple[List[int], List[float]]]:
+    """
+    params:
+        snapshot_dir - directory with the products snapshots
+        tickers - crypto currencies, eg. BTC
+    
+    Supply of every ticker as recorded in all the products snapshots, as (snapshot times as epoch in ms, supplies),
+    sorted by time. Snapshots without the ticker are skipped. Every snapshot is read once for all the tickers.
+    """
+    history = {ccy: ([], []) for ccy in tickers}
+    for timestamp, path in list_snapshots(snapshot_dir):
+        with open(path) as f:
+            products = json.load(f)
+        for ccy, _, supply in usdt_products(products):
+            if ccy in history:
+                history[ccy][0].append(timestamp * 1000)
+                history[ccy][1].append(supply)
+    return history
 
 
 def fix_time(epoch_num:int) -> str:
     """
     Small function to convert epoch time in ms to a str representation of the actual date.
     Binance APIs provide the date/time format in epoch which is not that easily readable.
+    The date is in UTC, same as the candles, not in the local timezone of the machine.
+    
+    """
+    return epoch_to_date(epoch_num)
+
+
+def date_to_epoch(date_str:str) -> int:
+    """
+    params:
+        date_str - date in format YYYY-MM-DD
+    
+    Inverse of fix_time - converts a str date to epoch time in ms, as of midnight UTC.
+    Used as the open time of the daily candles.
     
     """
-    s = epoch_num / 1000
-    return datetime.datetime.fromtimestamp(s).strftime('%Y-%m-%d')
+    y, m, d = date_str.split('-')
+    dt = datetime.datetime(int(y), int(m), int(d), tzinfo=datetime.timezone.utc)
+    return int(dt.timestamp()*1000)
 
 
 def last_day_of_month(any_day):
@@ -0,0 +1,187 @@
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+
+class _StdoutHandler(logging.StreamHandler):
+    """ Writes to the current sys.stdout, same as print """
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+# Logger for all the progress output of the pipeline - printed to stdout by default, same as before.
+# Set the level to WARNING (or higher) to silence it, the messages are not even formatted then.
+logger = logging.getLogger('binance_data')
+if not logger.handlers:
+    _handler = _StdoutHandler()
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+PREFIX = 'binance_data'
+
+
+class _NullStage:
+    """ Stage used while the instrumentation is disabled - does nothing """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    """ Times a stage, optionally tracking its peak memory and profiling it """
+
+    def __init__(self, metrics: 'Metrics', name: str):
+        self.metrics = metrics
+        self.name = name
+        self.profiler = None
+        self.started_tracing = False
+
+    def __enter__(self):
+        if self.metrics.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.started_tracing = True
+            tracemalloc.reset_peak()
+        if self.name in self.metrics.profile:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.started
+        if self.profiler is not None:
+            self.profiler.disable()
+        record = self.metrics.stages.setdefault(self.name, {'calls': 0, 'seconds': 0.0, 'peak_bytes': 0})
+        record['calls'] += 1
+        record['seconds'] += seconds
+
+        if self.metrics.memory:
+            # Nested stages reset the peak, so the peak of an outer stage covers only the part after them
+            record['peak_bytes'] = max(record['peak_bytes'], tracemalloc.get_traced_memory()[1])
+            if self.started_tracing:
+                tracemalloc.stop()
+
+        if self.profiler is not None:
+            self.metrics._save_profile(self.name, self.profiler)
+        return False
+
+
+class Metrics:
+    """
+    Stage timers and counters of the pipeline.
+
+    Disabled by default - stage() returns a shared no-op context manager and incr() returns straight away,
+    so the instrumentation costs nothing unless enabled.
+
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.memory = False
+        self.profile = ()
+        self.profile_dir = ''
+        # Counters are incremented from the download threads as well
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.stages = {}
+        self.counters = {}
+        self.profiles = {}
+
+    def enable(self, memory: bool = False, profile: tuple = (), profile_dir: str = '') -> None:
+        """
+        params:
+            memory - track the peak memory of every stage with tracemalloc (slows down the execution)
+            profile - names of the stages to be wrapped in cProfile
+            profile_dir - directory where the .prof files of the profiled stages are saved,
+                          otherwise the top functions are kept as text in the report
+        """
+        self.enabled = True
+        self.memory = memory
+        self.profile = tuple(profile)
+        self.profile_dir = profile_dir
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def stage(self, name: str):
+        """
+        params:
+            name - name of the stage, eg. download
+
+        Context manager timing the stage.
+        """
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def incr(self, name: str, n: int = 1) -> None:
+        """
+        params:
+            name - name of the counter, eg. http_requests
+            n - increment
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def _save_profile(self, name: str, profiler: cProfile.Profile) -> None:
+        if self.profile_dir:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            profiler.dump_stats(os.path.join(self.profile_dir, f'{name}.prof'))
+            return
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(30)
+        self.profiles[name] = out.getvalue()
+
+    def report(self) -> dict:
+        """ All the stages, counters and profiles collected """
+        return {'stages': self.stages, 'counters': self.counters, 'profiles': self.profiles}
+
+    def to_json(self) -> str:
+        return json.dumps(self.report(), indent=2)
+
+    def to_prometheus(self) -> str:
+        """ Stages and counters in the Prometheus text exposition format """
+        lines = []
+        for metric, key, kind in (('stage_calls_total', 'calls', 'counter'),
+                                  ('stage_seconds_total', 'seconds', 'counter'),
+                                  ('stage_peak_bytes', 'peak_bytes', 'gauge')):
+            lines.append(f'# TYPE {PREFIX}_{metric} {kind}')
+            for name, record in self.stages.items():
+                lines.append(f'{PREFIX}_{metric}{{stage="{name}"}} {record[key]}')
+        for name, value in self.counters.items():
+            lines.append(f'# TYPE {PREFIX}_{name}_total counter')
+            lines.append(f'{PREFIX}_{name}_total {value}')
+        return '\n'.join(lines) + '\n'
+
+
+# Shared by the whole pipeline
+metrics = Metrics()
+stage = metrics.stage
+incr = metrics.incr
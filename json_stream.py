@@ -0,0 +1,98 @@
+import json
+from typing import Iterator, Tuple
+
+# Number of characters read from the file at once.
+CHUNK_SIZE = 1 << 16
+
+WHITESPACE = ' \t\n\r'
+
+
+class _Reader:
+    """
+    Buffered reader over a text file, decoding JSON values one at a time.
+    Only the part of the file not parsed yet is kept in memory.
+
+    """
+
+    def __init__(self, f, chunk_size: int = CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _read_more(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        # Drop the part already parsed
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """ Next non whitespace character, without consuming it. Empty string at the end of the file. """
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._read_more():
+                return ''
+
+    def expect(self, chars: str) -> str:
+        """ Consumes the next non whitespace character, which must be one of the chars given. """
+        c = self.peek()
+        if not c or c not in chars:
+            raise ValueError(f'Invalid JSON dataset, expected one of {chars!r}, got {c!r}')
+        self.pos += 1
+        return c
+
+    def value(self):
+        """ Decodes the next JSON value, reading more of the file until it is complete. """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self._read_more():
+                    raise
+                continue
+            self.pos = end
+            return value
+
+
+def _iter_object(reader: _Reader) -> Iterator[str]:
+    """
+    Iterates over the keys of a JSON object, leaving the reader right before the value of every key.
+    """
+    reader.expect('{')
+    if reader.peek() == '}':
+        reader.pos += 1
+        return
+    while True:
+        key = reader.value()
+        reader.expect(':')
+        yield key
+        if reader.expect(',}') == '}':
+            return
+
+
+def iter_dataset(file_name: str, chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple[str, str, list]]:
+    """
+    params:
+        file_name - JSON file saved from load_data, in the format {ccy: {date: [...]}}
+        chunk_size - number of characters read from the file at once
+
+    Streaming parser of the dataset - yields (ccy, date, data list) one by one, without loading the whole file.
+    Peak memory is about a chunk of the file and a single data list.
+    """
+    with open(file_name) as f:
+        reader = _Reader(f, chunk_size)
+        for ccy in _iter_object(reader):
+            for date in _iter_object(reader):
+                yield ccy, date, reader.value()
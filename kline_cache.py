@@ -0,0 +1,175 @@
+import os
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+import numpy as np
+from kline_downloader import KLINES_URL, MAX_LIMIT, WEIGHT_PER_MINUTE, RateLimiter, create_session, iter_kline_pages
+from kline_store import KlineStoreBuilder, KlineStore
+from generic_helpers import supply_history
+from kline_records import KLINE_DTYPE, empty_records, from_klines, to_bytes
+from instrumentation import incr
+
+# Fixed size binary record of a single kline:
+# open time, open, high, low, close, volume, close time, quote asset volume,
+# number of trades, taker buy base asset volume, taker buy quote asset volume
+RECORD = struct.Struct('<q5dqdq2d')
+# Same layout as the kline_records dtype, so the files can be read straight into records arrays
+assert RECORD.size == KLINE_DTYPE.itemsize
+
+
+class KlineCache:
+    """
+    Persistent local cache of klines, one append only binary file per (symbol, interval).
+
+    Every file is a sequence of fixed size records sorted by open time, so the last stored kline is read
+    straight from the end of the file. On refresh only the missing tail after it is fetched and appended
+    in place, with no rewrite of the file.
+
+    """
+
+    def __init__(self, cache_dir: str, url: str = KLINES_URL):
+        """
+        params:
+            cache_dir - directory for the cache files, created if it does not exist
+            url - URL of the klines endpoint
+        """
+        self.cache_dir = cache_dir
+        self.url = url
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, symbol: str, interval: str) -> str:
+        return os.path.join(self.cache_dir, f'{symbol}_{interval}.bin')
+
+    def count(self, symbol: str, interval: str) -> int:
+        """ Number of klines stored """
+        path = self.path(symbol, interval)
+        if not os.path.exists(path):
+            return 0
+        return os.path.getsize(path) // RECORD.size
+
+    def last_kline(self, symbol: str, interval: str) -> tuple:
+        """
+        Last stored kline as a tuple with the fields of the record, None if nothing is stored yet.
+        """
+        n = self.count(symbol, interval)
+        if n == 0:
+            return None
+        with open(self.path(symbol, interval), 'rb') as f:
+            f.seek((n - 1) * RECORD.size)
+            return RECORD.unpack(f.read(RECORD.size))
+
+    def read(self, symbol: str, interval: str) -> List[tuple]:
+        """
+        All the stored klines as tuples with the fields of the record.
+        """
+        path = self.path(symbol, interval)
+        if not os.path.exists(path):
+            return []
+        with open(path, 'rb') as f:
+            data = f.read(self.count(symbol, interval) * RECORD.size)
+        return list(RECORD.iter_unpack(data))
+
+    def read_records(self, symbol: str, interval: str) -> np.ndarray:
+        """
+        All the stored klines as a kline_records array, read straight from the file.
+        """
+        path = self.path(symbol, interval)
+        if not os.path.exists(path):
+            return empty_records()
+        return np.fromfile(path, dtype=KLINE_DTYPE, count=self.count(symbol, interval))
+
+    def append(self, symbol: str, interval: str, klines: List[list]) -> int:
+        """
+        params:
+            symbol - trading pair, eg. BTCUSDT
+            interval - frequency of the klines, eg. 1d, 1h
+            klines - klines payload from the API or a kline_records array, sorted by open time
+
+        Appends the klines at the end of the file, after the last complete record.
+        Klines overlapping with the already stored ones (open time not after the last stored open time) are skipped.
+        Returns the number of klines appended.
+        """
+        records = klines if isinstance(klines, np.ndarray) else from_klines(klines)
+        last = self.last_kline(symbol, interval)
+        open_time = records['open_time']
+        # Open time after the last stored one and after all the previous ones in the klines
+        prev_max = np.maximum.accumulate(np.concatenate([[last[0] if last else np.iinfo(np.int64).min], open_time]))[:-1]
+        records = records[open_time > prev_max]
+
+        if len(records):
+            with open(self.path(symbol, interval), 'ab') as f:
+                # A previous write interrupted halfway leaves a partial record at the end of the file,
+                # which is dropped before appending, otherwise all the new records would be misaligned
+                f.truncate(self.count(symbol, interval) * RECORD.size)
+                f.write(to_bytes(records))
+        incr('klines_appended', len(records))
+        incr('klines_skipped', len(klines) - len(records))
+        return len(records)
+
+    def validate(self, symbol: str, interval: str) -> Dict[str, List[Tuple[int, int]]]:
+        """
+        Checks the stored klines for gaps and overlaps between consecutive klines.
+        Returns dictionary with lists of (close time, next open time) for both:
+            gaps - next kline opens later than 1 ms after the previous close
+            overlaps - next kline opens before the previous close
+        """
+        records = self.read_records(symbol, interval)
+        close_time, next_open = records['close_time'][:-1], records['open_time'][1:]
+        pairs = lambda mask: list(zip(close_time[mask].tolist(), next_open[mask].tolist()))
+        return {'gaps': pairs(next_open > close_time + 1), 'overlaps': pairs(next_open <= close_time)}
+
+    def refresh(self,
+                symbols: List[str],
+                interval: str,
+                start: int,
+                end: int = None,
+                max_workers: int = 8,
+                weight_per_minute: int = WEIGHT_PER_MINUTE) -> Dict[str, int]:
+        """
+        params:
+            symbols - trading pairs, eg. BTCUSDT
+            interval - frequency of the klines, eg. 1d, 1h
+            start - begin of interval, epoch time in ms. Used only for symbols with nothing stored yet.
+            end - end of interval, epoch time in ms. Now by default.
+            max_workers - max number of concurrent requests
+            weight_per_minute - allowed request weight per minute
+
+        Fetches only the klines after the last stored one for every symbol and appends them.
+        The kline still open at the moment is not stored, since it will change until its close time.
+        Returns dictionary of symbol to the number of klines appended.
+        """
+        now = int(time.time() * 1000)
+        end = now if end is None else end
+        session = create_session(max_workers)
+        rate_limiter = RateLimiter(weight_per_minute)
+
+        def refresh_symbol(symbol):
+            last = self.last_kline(symbol, interval)
+            # Index 6 is the close time
+            symbol_start = last[6] + 1 if last else start
+            appended = 0
+            for page in iter_kline_pages(session, symbol, interval, symbol_start, end, MAX_LIMIT, self.url, rate_limiter, True):
+                appended += self.append(symbol, interval, page[page['close_time'] < now])
+            return appended
+
+        with session, ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(refresh_symbol, symbol) for symbol in symbols]
+            return {symbol: future.result() for symbol, future in zip(symbols, futures)}
+
+    def to_store(self, cryptos: List[list], interval: str, quote: str = 'USDT', snapshot_dir: str = '') -> KlineStore:
+        """
+        params:
+            cryptos - crypto currencies, together with their market cap and supply, as for load_data
+            interval - frequency of the klines, eg. 1d, 1h
+            quote - quote asset of the trading pairs
+            snapshot_dir - optional directory with the products snapshots, for the supply as of every kline (see load_data)
+
+        Columnar KlineStore from the cached klines.
+        """
+        histories = supply_history(snapshot_dir, [ccy for ccy, _, _ in cryptos]) if snapshot_dir else {}
+        builder = KlineStoreBuilder()
+        for ccy, _, supply in cryptos:
+            builder.add_symbol(ccy, float(supply), histories.get(ccy))
+            builder.add_records(ccy, self.read_records(ccy + quote, interval))
+        return builder.build()
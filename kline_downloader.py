@@ -0,0 +1,289 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List
+import requests
+from requests.adapters import HTTPAdapter
+import numpy as np
+from kline_records import empty_records, parse_klines
+from instrumentation import incr
+
+KLINES_URL = "https://api.binance.com/api/v3/klines"
+
+# Binance request weight limit per minute per IP, as of the time of dev of this module.
+WEIGHT_PER_MINUTE = 1200
+
+# Max number of klines returned by the API for a single request.
+MAX_LIMIT = 1000
+
+# Status codes on which the request is retried with a backoff.
+# 429 is returned when the request weight limit is hit, 5xx are problems on the Binance side.
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Connect and read timeouts in seconds of a single request. A stalled connection fails with
+# requests.Timeout after these and the request is retried, instead of blocking the worker forever.
+TIMEOUT = (5, 30)
+
+
+def klines_weight(limit: int) -> int:
+    """
+    params:
+        limit - number of klines requested
+
+    Request weight of the klines endpoint, which depends on the limit.
+    """
+    if limit <= 100:
+        return 1
+    if limit <= 500:
+        return 2
+    if limit <= 1000:
+        return 5
+    return 10
+
+
+class RateLimiter:
+    """
+    Client side rate limiter for the Binance request weight limits.
+
+    Token bucket with capacity of the allowed weight per minute, refilled continuously.
+    Thread safe, so a single one is shared between all the workers.
+
+    """
+
+    def __init__(self, weight_per_minute: int = WEIGHT_PER_MINUTE):
+        """
+        params:
+            weight_per_minute - allowed request weight per minute
+        """
+        assert weight_per_minute > 0
+        self.capacity = weight_per_minute
+        self.tokens = float(weight_per_minute)
+        self.rate = weight_per_minute / 60
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, weight: int = 1) -> None:
+        """
+        params:
+            weight - request weight to be used
+
+        Blocks until the weight is available.
+        """
+        weight = min(weight, self.capacity)
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= weight:
+                    self.tokens -= weight
+                    return
+                wait = (weight - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def sync(self, used_weight: int) -> None:
+        """
+        params:
+            used_weight - weight used in the current minute as reported by the server (X-MBX-USED-WEIGHT-1M)
+
+        Other clients on the same IP use the same limit, so the server side count is respected as well.
+        """
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.tokens, self.capacity - used_weight)
+
+
+def create_session(pool_size: int = 10) -> requests.Session:
+    """
+    params:
+        pool_size - max number of connections kept open, should be at least the number of workers
+
+    Session shared between all the requests, so the TCP/TLS connections are reused.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.verify = False
+    return session
+
+
+def get_json(session: requests.Session,
+             url: str,
+             params: dict,
+             rate_limiter: RateLimiter = None,
+             weight: int = 1,
+             retries: int = 5,
+             backoff: float = 0.5,
+             parse: Callable[[bytes], object] = None,
+             timeout: tuple = TIMEOUT):
+    """
+    params:
+        session - session to be used for the request
+        url - URL of the endpoint
+        params - query parameters
+        rate_limiter - optional rate limiter, shared between the workers
+        weight - request weight of the endpoint
+        retries - number of retries on 429/5xx responses, connection errors and timeouts
+        backoff - initial wait time in seconds between the retries, doubled on every retry
+        parse - optional parser of the raw response body, used instead of the JSON decoding
+        timeout - connect and read timeouts in seconds, see requests
+
+    GET request returning the parsed JSON payload.
+    Retry-After header is respected, if provided on 429.
+    """
+    for attempt in range(retries + 1):
+        if rate_limiter is not None:
+            rate_limiter.acquire(weight)
+
+        incr('http_requests')
+        try:
+            res = session.get(url, params=params, timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout):
+            incr('http_errors')
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+            continue
+
+        used_weight = res.headers.get('X-MBX-USED-WEIGHT-1M')
+        if rate_limiter is not None and used_weight:
+            rate_limiter.sync(int(used_weight))
+
+        incr('http_bytes', len(res.content))
+        if res.status_code == 200:
+            return parse(res.content) if parse is not None else json.loads(res.text)
+
+        incr('http_errors')
+        if res.status_code not in RETRY_STATUS_CODES or attempt == retries:
+            raise Exception(f'Something went wrong with the GET request. MSG: {res.text}')
+
+        retry_after = res.headers.get('Retry-After')
+        time.sleep(float(retry_after) if retry_after else backoff * 2 ** attempt)
+
+
+def fetch_klines(session: requests.Session,
+                 symbol: str,
+                 frequency: str,
+                 start: int,
+                 end: int,
+                 limit: int = 1000,
+                 url: str = KLINES_URL,
+                 rate_limiter: RateLimiter = None,
+                 records: bool = False) -> List[list]:
+    """
+    params:
+        session - session to be used for the request
+        symbol - trading pair, eg. BTCUSDT
+        frequency - frequency to extract the data for, eg. every 1d, 1h, etc.
+        start - begin of interval, epoch time in ms
+        end - end of interval, epoch time in ms
+        limit - max number of klines to be returned
+        url - URL of the klines endpoint
+        rate_limiter - optional rate limiter, shared between the workers
+        records - parse the payload straight into the compact kline_records array instead of lists
+
+    Klines payload for a single symbol, see load_data for the format.
+    """
+    # The API never returns more than MAX_LIMIT klines, whatever the limit requested
+    limit = min(limit, MAX_LIMIT)
+    params = {
+        'symbol': symbol,
+        'interval': frequency,
+        'startTime': start,
+        'endTime': end,
+        'limit': limit
+    }
+    return get_json(session, url, params, rate_limiter, klines_weight(limit), parse=parse_klines if records else None)
+
+
+def iter_kline_pages(session: requests.Session,
+                     symbol: str,
+                     frequency: str,
+                     start: int,
+                     end: int,
+                     limit: int = MAX_LIMIT,
+                     url: str = KLINES_URL,
+                     rate_limiter: RateLimiter = None,
+                     records: bool = False) -> Iterator[List[list]]:
+    """
+    params:
+        session - session to be used for the requests
+        symbol - trading pair, eg. BTCUSDT
+        frequency - frequency to extract the data for, eg. every 1d, 1h, etc.
+        start - begin of interval, epoch time in ms
+        end - end of interval, epoch time in ms
+        limit - max number of klines per request (page), at most MAX_LIMIT
+        url - URL of the klines endpoint
+        rate_limiter - optional rate limiter, shared between the workers
+        records - yield the pages as compact kline_records arrays instead of lists
+
+    Yields the klines for the whole interval page by page. The API returns at most "limit" klines per request,
+    so the start time is moved forward to right after the close time of the last kline, until the end is reached.
+    A short page does not mean the end of the data (the API may cap it below the limit), so paging stops only
+    past the end, on an empty page or when the close time does not move forward.
+    """
+    limit = min(limit, MAX_LIMIT)
+    while start <= end:
+        page = fetch_klines(session, symbol, frequency, start, end, limit, url, rate_limiter, records)
+        if len(page) == 0:
+            return
+        yield page
+        # Index 6 is the close time
+        next_start = int(page[-1][6]) + 1
+        if next_start <= start:
+            return
+        start = next_start
+
+
+def fetch_all_klines(symbols: List[str],
+                     frequency: str,
+                     start: int,
+                     end: int,
+                     limit: int = MAX_LIMIT,
+                     max_workers: int = 8,
+                     url: str = KLINES_URL,
+                     weight_per_minute: int = WEIGHT_PER_MINUTE,
+                     on_page: Callable[[str, List[list]], None] = None,
+                     records: bool = False) -> Dict[str, List[list]]:
+    """
+    params:
+        symbols - trading pairs, eg. BTCUSDT
+        frequency - frequency to extract the data for, eg. every 1d, 1h, etc.
+        start - begin of interval, epoch time in ms
+        end - end of interval, epoch time in ms
+        limit - max number of klines per request, longer intervals are fetched in pages
+        max_workers - max number of concurrent requests
+        url - URL of the klines endpoint, eg. a local stub server for testing
+        weight_per_minute - allowed request weight per minute
+        on_page - optional callback called with (symbol, page) for every page, as soon as it is received.
+                  All pages of a symbol are passed in order and from the same worker thread.
+        records - parse the pages straight into compact kline_records arrays (88 bytes per kline),
+                  instead of the lists of strings from the JSON payload
+
+    Fetches the klines for all the symbols concurrently, over a thread pool sharing one pooled session.
+    Returns dictionary of symbol to its klines payload, in the order of the symbols.
+    If on_page is given, pages are passed to it instead of being collected and the payloads are empty.
+    """
+    assert max_workers > 0
+    session = create_session(max_workers)
+    rate_limiter = RateLimiter(weight_per_minute)
+
+    with session, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        def fetch(symbol):
+            pages = []
+            for page in iter_kline_pages(session, symbol, frequency, start, end, limit, url, rate_limiter, records):
+                if on_page is not None:
+                    on_page(symbol, page)
+                else:
+                    pages.append(page)
+            if records:
+                return np.concatenate(pages) if pages else empty_records()
+            return [k for page in pages for k in page]
+
+        futures = [executor.submit(fetch, symbol) for symbol in symbols]
+        return {symbol: future.result() for symbol, future in zip(symbols, futures)}
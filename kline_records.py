@@ -0,0 +1,109 @@
+from typing import List, Tuple, Union
+import numpy as np
+
+# Compact fixed size record of a single kline, packed with no padding (88 bytes).
+# Same fields and layout as the klines payload from the API, without the last "Ignore" one,
+# and the same as the binary records of the KlineCache files, so those can be read straight into an array.
+KLINE_DTYPE = np.dtype([
+    ('open_time', '<i8'),
+    ('open', '<f8'),
+    ('high', '<f8'),
+    ('low', '<f8'),
+    ('close', '<f8'),
+    ('volume', '<f8'),
+    ('close_time', '<i8'),
+    ('quote_volume', '<f8'),
+    ('trades', '<i8'),
+    ('taker_base_volume', '<f8'),
+    ('taker_quote_volume', '<f8')
+])
+
+# Number of values per kline in the API payload, including the "Ignore" one
+PAYLOAD_WIDTH = 12
+
+# Binance sends the prices and volumes as strings with 8 decimals
+DECIMALS = 8
+
+
+def empty_records(n: int = 0) -> np.ndarray:
+    """ Array of n klines records, all zeros """
+    return np.zeros(n, dtype=KLINE_DTYPE)
+
+
+def _from_table(table: np.ndarray) -> np.ndarray:
+    """ Klines records from a 2D float array with the values of the payload, one row per kline """
+    records = np.empty(len(table), dtype=KLINE_DTYPE)
+    for i, name in enumerate(KLINE_DTYPE.names):
+        # The epoch times in ms and the trades are way below 2^53, so they are exact in the float table
+        records[name] = table[:, i]
+    return records
+
+
+def parse_klines(payload: Union[bytes, str]) -> np.ndarray:
+    """
+    params:
+        payload - raw body of the klines response, see load_data for the format
+
+    Parses the klines payload straight into the compact records, in one pass in C -
+    no lists of strings or Python floats are created on the way.
+    """
+    if isinstance(payload, str):
+        payload = payload.encode()
+    n = payload.count(b'[') - 1
+    if n <= 0:
+        return empty_records()
+
+    # Only the numbers are left, separated by commas, eg. [[1,"0.1",...],[...]] -> 1,0.1,...,...
+    values = np.fromstring(payload.translate(None, b'[]" \r\n\t').decode(), dtype=np.float64, sep=',')
+    if len(values) != n * PAYLOAD_WIDTH:
+        raise ValueError(f'Unexpected klines payload - {len(values)} values for {n} klines.')
+    return _from_table(values.reshape(n, PAYLOAD_WIDTH))
+
+
+def from_klines(klines: List[list]) -> np.ndarray:
+    """
+    params:
+        klines - klines payload already decoded from JSON, eg. from the WebSocket streams
+
+    Converts the klines to the compact records.
+    """
+    if not len(klines):
+        return empty_records()
+    return _from_table(np.array([k[:len(KLINE_DTYPE.names)] for k in klines], dtype=np.float64))
+
+
+def to_bytes(records: np.ndarray) -> bytes:
+    """ Packed binary serialization of the records, 88 bytes per kline """
+    return np.ascontiguousarray(records, dtype=KLINE_DTYPE).tobytes()
+
+
+def market_caps(records: np.ndarray, supply: float, supply_history: Tuple[List[int], List[float]] = None) -> np.ndarray:
+    """
+    params:
+        records - klines records, sorted by open time
+        supply - supply used when there is no history, eg. the current one
+        supply_history - optional (snapshot times as epoch in ms, supplies) sorted by time, see generic_helpers.supply_history
+
+    Market cap of every kline - the close multiplied by the supply as of the close time of the kline, from the latest
+    products snapshot taken by then. Klines before the first snapshot use the first one, the earliest supply known.
+    """
+    if not supply_history or not len(supply_history[0]):
+        return records['close'] * supply
+    times, supplies = supply_history
+    pos = np.searchsorted(np.asarray(times, dtype=np.int64), records['close_time'], side='right') - 1
+    return records['close'] * np.asarray(supplies, dtype=np.float64)[np.maximum(pos, 0)]
+
+
+def to_payload_row(record: np.void, market_cap: float) -> list:
+    """
+    params:
+        record - single kline record
+        market_cap - market cap to be appended
+
+    Row of the JSON dataset saved from load_data - the kline without the open time, in the format of the API
+    payload (prices and volumes as strings with 8 decimals), with the market cap appended.
+    """
+    return [f'{record["open"]:.{DECIMALS}f}', f'{record["high"]:.{DECIMALS}f}', f'{record["low"]:.{DECIMALS}f}',
+            f'{record["close"]:.{DECIMALS}f}', f'{record["volume"]:.{DECIMALS}f}', int(record['close_time']),
+            f'{record["quote_volume"]:.{DECIMALS}f}', int(record['trades']), f'{record["taker_base_volume"]:.{DECIMALS}f}',
+            f'{record["taker_quote_volume"]:.{DECIMALS}f}', '0', market_cap]
@@ -0,0 +1,305 @@
+from array import array
+from typing import Callable, Dict, List
+import numpy as np
+from generic_helpers import date_to_epoch
+from calendar_index import CalendarIndex
+from kline_records import market_caps
+from json_stream import iter_dataset
+from instrumentation import incr, stage
+
+# Fields kept in the store, one typed array per field.
+FIELDS = ('open', 'high', 'low', 'close', 'volume', 'trades', 'market_cap')
+
+# Positions of the fields in the per-date lists of the JSON dataset (see load_data).
+# The open time is not in there, since it was moved outside of the list as the date key.
+DATASET_POSITIONS = {
+    'open': 0,
+    'high': 1,
+    'low': 2,
+    'close': 3,
+    'volume': 4,
+    'trades': 7,
+    'market_cap': -1
+}
+
+
+def field_dtype(field:str) -> type:
+    """
+    params:
+        field - one of the FIELDS
+
+    Trades are an integer count, everything else is a float.
+    """
+    return np.int64 if field == 'trades' else np.float64
+
+
+def missing_value(field:str):
+    """
+    params:
+        field - one of the FIELDS
+
+    Value used for a symbol that has no candle for a given open time.
+    """
+    return 0 if field == 'trades' else np.nan
+
+
+class KlineStore:
+    """
+    Columnar storage of klines for a group of cryptocurrencies.
+
+    All symbols share one int64 open time axis (epoch in ms), and every field is kept as a
+    separate 2D array with shape (symbols, open times). Missing candles are NaN (0 for trades).
+    Saved as a binary .npz file, so that loading it back needs no string parsing at all.
+    Only a part of the fields can be kept, eg. close and market cap only for the statistics.
+
+    """
+
+    def __init__(self, symbols:List[str], open_time:np.ndarray, columns:Dict[str, np.ndarray]):
+        """
+        params:
+            symbols - cryptocurrency tickers, eg. BTC, ETH
+            open_time - sorted open times of the candles, epoch in ms
+            columns - dictionary of field name to array with shape (len(symbols), len(open_time)),
+                      for all or only some of the FIELDS
+        """
+        self.symbols = list(symbols)
+        self.symbol_index = {ccy: i for i, ccy in enumerate(self.symbols)}
+        self.open_time = np.asarray(open_time, dtype=np.int64)
+        self.columns = {}
+        self._calendar = None
+
+        for field in columns:
+            if field not in FIELDS:
+                raise ValueError(f'Unknown field: {field}')
+            col = np.asarray(columns[field], dtype=field_dtype(field))
+            if col.shape != (len(self.symbols), len(self.open_time)):
+                raise ValueError(f'Column {field} has shape {col.shape}, expected {(len(self.symbols), len(self.open_time))}')
+            self.columns[field] = col
+
+    def __len__(self) -> int:
+        return len(self.symbols)
+
+    def __contains__(self, ccy:str) -> bool:
+        return ccy in self.symbol_index
+
+    @property
+    def calendar(self) -> CalendarIndex:
+        """ Day and month offsets of the open times, computed on first use """
+        if self._calendar is None:
+            self._calendar = CalendarIndex(self.open_time)
+        return self._calendar
+
+    def column(self, field:str) -> np.ndarray:
+        """
+        params:
+            field - one of the FIELDS
+
+        2D array of the field for all the symbols and open times.
+        """
+        return self.columns[field]
+
+    def time_index(self, open_time:int) -> int:
+        """
+        params:
+            open_time - epoch time in ms
+
+        Position of the open time on the time axis, -1 if there is no such open time.
+        """
+        i = int(np.searchsorted(self.open_time, open_time))
+        if i < len(self.open_time) and self.open_time[i] == open_time:
+            return i
+        return -1
+
+    def date_index(self, date:str) -> int:
+        """
+        params:
+            date - date in format YYYY-MM-DD
+
+        Position of the daily candle opening on that date, -1 if there is no such date.
+        """
+        return self.time_index(date_to_epoch(date))
+
+    def get(self, field:str, ccy:str, date:str) -> float:
+        """
+        params:
+            field - one of the FIELDS
+            ccy - cryptocurrency ticker
+            date - date in format YYYY-MM-DD
+
+        Single value lookup. Raises KeyError for an unknown symbol or date.
+        """
+        i = self.date_index(date)
+        if i < 0:
+            raise KeyError(date)
+        return self.columns[field][self.symbol_index[ccy], i]
+
+    def save(self, file_name:str) -> None:
+        """
+        params:
+            file_name - name of the .npz file to be saved on the FS
+        """
+        np.savez(file_name,
+                 symbols=np.array(self.symbols, dtype=str),
+                 open_time=self.open_time,
+                 **self.columns)
+
+    @classmethod
+    def load(cls, file_name:str, fields:tuple = FIELDS) -> 'KlineStore':
+        """
+        params:
+            file_name - name of an .npz file saved with KlineStore.save
+            fields - fields to be loaded, the rest are not read from the file at all
+        """
+        with np.load(file_name) as data:
+            return cls(symbols=data['symbols'].tolist(),
+                       open_time=data['open_time'],
+                       columns={field: data[field] for field in fields if field in data.files})
+
+
+class KlineStoreBuilder:
+    """
+    Builds a KlineStore from klines payloads, which are streamed page by page.
+
+    Every symbol has its own typed buffers, so the pages of different symbols can be added from different threads.
+    Market cap is the close price multiplied by the supply of the symbol, as of the kline if its supply history is given.
+
+    """
+
+    def __init__(self, fields:tuple = FIELDS):
+        """
+        params:
+            fields - fields to be kept, the rest are discarded
+        """
+        self.fields = tuple(fields)
+        self.open_times = {}
+        self.buffers = {}
+        self.supplies = {}
+        self.supply_histories = {}
+
+    def add_symbol(self, ccy:str, supply:float = 0.0, supply_history:tuple = None) -> None:
+        """
+        params:
+            ccy - cryptocurrency ticker
+            supply - supply used for the market cap
+            supply_history - optional (snapshot times, supplies) of the symbol, used for the market cap instead
+        """
+        self.open_times[ccy] = array('q')
+        self.buffers[ccy] = {field: array('q' if field == 'trades' else 'd') for field in self.fields}
+        self.supplies[ccy] = supply
+        self.supply_histories[ccy] = supply_history
+
+    def add_records(self, ccy:str, records:np.ndarray) -> None:
+        """
+        params:
+            ccy - cryptocurrency ticker, added with add_symbol before
+            records - klines as a kline_records array, eg. a page parsed with parse_klines
+
+        The fields are copied column by column, with no per kline conversions.
+        """
+        self.open_times[ccy].frombytes(np.ascontiguousarray(records['open_time']).tobytes())
+        buffers = self.buffers[ccy]
+        for field in self.fields:
+            if field == 'market_cap':
+                values = market_caps(records, self.supplies[ccy], self.supply_histories[ccy])
+            else:
+                values = np.ascontiguousarray(records[field], dtype=field_dtype(field))
+            buffers[field].frombytes(values.tobytes())
+
+    def add_row(self, ccy:str, open_time:int, *values) -> None:
+        """
+        params:
+            ccy - cryptocurrency ticker, added with add_symbol before
+            open_time - epoch time in ms
+            values - values of the fields kept, in the order of the fields of the builder
+        """
+        self.open_times[ccy].append(open_time)
+        buffers = self.buffers[ccy]
+        for field, value in zip(self.fields, values):
+            buffers[field].append(value)
+
+    def build(self) -> KlineStore:
+        symbols = list(self.open_times.keys())
+        return aligned_store(symbols,
+                             [np.frombuffer(self.open_times[ccy], dtype=np.int64) for ccy in symbols],
+                             lambda ccy, field: np.frombuffer(self.buffers[ccy][field], dtype=field_dtype(field)),
+                             self.fields)
+
+
+def aligned_store(symbols:List[str],
+                  open_times:List[np.ndarray],
+                  values:Callable[[str, str], np.ndarray],
+                  fields:tuple = FIELDS) -> KlineStore:
+    """
+    params:
+        symbols - cryptocurrency tickers
+        open_times - sorted open times of the klines of every symbol
+        values - function of (ccy, field) returning the values of the field for the klines of the symbol
+        fields - fields of the store
+
+    KlineStore with the klines of all the symbols aligned on their shared open time axis, missing candles filled.
+    """
+    open_time = np.unique(np.concatenate(open_times)) if open_times else np.array([], dtype=np.int64)
+    columns = {field: np.full((len(symbols), len(open_time)), missing_value(field), dtype=field_dtype(field))
+               for field in fields}
+    for i, ccy in enumerate(symbols):
+        pos = np.searchsorted(open_time, open_times[i])
+        for field in fields:
+            columns[field][i, pos] = values(ccy, field)
+
+    return KlineStore(symbols, open_time, columns)
+
+
+def store_from_records(records:Dict[str, np.ndarray],
+                       supplies:Dict[str, float],
+                       supply_histories:Dict[str, tuple] = None,
+                       fields:tuple = FIELDS) -> KlineStore:
+    """
+    params:
+        records - dictionary of crypto currency to its klines, as kline_records arrays sorted by open time
+        supplies - dictionary of crypto currency to its supply, for the market cap
+        supply_histories - optional dictionary of crypto currency to its supply history, see kline_records.market_caps
+        fields - fields of the store
+
+    KlineStore straight from the records already in memory, with no intermediate buffers.
+    """
+    histories = supply_histories or {}
+
+    def values(ccy, field):
+        if field == 'market_cap':
+            return market_caps(records[ccy], supplies[ccy], histories.get(ccy))
+        return records[ccy][field]
+
+    symbols = list(records.keys())
+    return aligned_store(symbols, [records[ccy]['open_time'] for ccy in symbols], values, fields)
+
+
+def load_kline_store(file_name:str, fields:tuple = FIELDS) -> KlineStore:
+    """
+    params:
+        file_name - either .npz file saved with KlineStore.save or a JSON file saved from load_data
+        fields - fields to be loaded
+
+    Loads the store from the binary format, or converts a JSON dataset in case such is provided.
+    The JSON file is parsed in a streaming way, symbol by symbol and date by date, keeping only the fields needed.
+    """
+    with stage('parse'):
+        if file_name.endswith('.npz'):
+            return KlineStore.load(file_name, fields)
+
+        builder = KlineStoreBuilder(fields)
+        positions = [DATASET_POSITIONS[field] for field in builder.fields]
+        is_int = [field == 'trades' for field in builder.fields]
+        open_times = {}
+        rows = 0
+
+        for ccy, date, row in iter_dataset(file_name):
+            if ccy not in builder.buffers:
+                builder.add_symbol(ccy)
+            if date not in open_times:
+                open_times[date] = date_to_epoch(date)
+            builder.add_row(ccy, open_times[date],
+                            *(int(row[pos]) if as_int else float(row[pos]) for pos, as_int in zip(positions, is_int)))
+            rows += 1
+
+        incr('candles_parsed', rows)
+        return builder.build()
@@ -0,0 +1,221 @@
+import asyncio
+import json
+from typing import Callable, List
+import numpy as np
+from kline_cache import KlineCache
+from math_helpers import RankCorrelation
+from rolling_stats import RunningCovarianceMatrix, RunningRatios
+
+# websockets is optional - needed only for the live streaming mode
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+STREAM_URL = 'wss://stream.binance.com:9443/stream'
+
+
+def stream_url(symbols: List[str], interval: str, url: str = STREAM_URL) -> str:
+    """
+    params:
+        symbols - trading pairs, eg. BTCUSDT
+        interval - frequency of the klines, eg. 1m, 1h, 1d
+        url - base URL of the combined streams endpoint
+
+    URL of a single connection multiplexing the kline streams of all the symbols.
+    """
+    streams = '/'.join(f'{symbol.lower()}@kline_{interval}' for symbol in symbols)
+    return f'{url}?streams={streams}'
+
+
+def parse_kline_event(message: str):
+    """
+    params:
+        message - message received from the combined streams
+
+    Converts a kline event to the symbol and the kline in the same format as the REST klines payload (see load_data).
+    Returns None for klines that are not closed yet, since they still change until their close time.
+    """
+    data = json.loads(message)
+    data = data.get('data', data)
+    if data.get('e') != 'kline':
+        return None
+    k = data['k']
+    if not k['x']:
+        return None
+    return data['s'], [k['t'], k['o'], k['h'], k['l'], k['c'], k['v'], k['T'], k['q'], k['n'], k['V'], k['Q'], '0']
+
+
+class LiveStatistics:
+    """
+    Statistics updated incrementally with every closed candle:
+        per symbol - Sharpe and Sortino Ratios of the returns, rank correlation of the market cap vs. the return
+        all pairs - correlation matrix of the returns, updated once all the symbols have closed the same candle
+
+    A candle missed by some of the symbols (eg. after a reconnect, or a symbol no longer traded) never completes
+    its cross section, so it is skipped for the pairs - dropped once a later candle completes, or once there are
+    more than max_pending incomplete ones.
+
+    """
+
+    def __init__(self,
+                 cryptos: List[list],
+                 window: int = None,
+                 MAR: float = 0.0,
+                 quote: str = 'USDT',
+                 max_pending: int = 10):
+        """
+        params:
+            cryptos - crypto currencies, together with their market cap and supply, as from get_top_cryptoccy_by_market_cap
+            window - size of a fixed rolling window, None for an expanding window.
+                     Expanding rank correlations cost O(n) per candle in the number of candles streamed so far.
+            MAR - minimum acceptance return for the Sortino Ratio
+            quote - quote asset of the trading pairs
+            max_pending - max number of open times waiting for the candles of all the symbols
+        """
+        self.symbols = [ccy + quote for ccy, _, _ in cryptos]
+        self.index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.supplies = {ccy + quote: float(supply) for ccy, _, supply in cryptos}
+        self.last_close = {}
+        self.last_open_time = {}
+        self.ratios = {symbol: RunningRatios(window, MAR) for symbol in self.symbols}
+        self.rank_corr = {symbol: RankCorrelation(window) for symbol in self.symbols}
+        self.correlations = RunningCovarianceMatrix(len(self.symbols), window)
+        self.pending = {}
+        self.max_pending = max_pending
+        self.skipped = 0
+
+    def update(self, symbol: str, kline: list) -> dict:
+        """
+        params:
+            symbol - trading pair, eg. BTCUSDT
+            kline - closed kline, in the format of the REST klines payload
+
+        Ingests a closed candle. Returns the updated statistics of the symbol, None for its first candle.
+        A candle not after the last one of the symbol (eg. delivered again after a reconnect) is ignored, returns None.
+        """
+        last_open_time = self.last_open_time.get(symbol)
+        if last_open_time is not None and kline[0] <= last_open_time:
+            return None
+        self.last_open_time[symbol] = kline[0]
+
+        close = float(kline[4])
+        prev = self.last_close.get(symbol)
+        self.last_close[symbol] = close
+        if prev is None:
+            return None
+
+        r = close / prev - 1
+        ratios = self.ratios[symbol]
+        rank_corr = self.rank_corr[symbol]
+        ratios.add(r)
+        rank_corr.append(r, close * self.supplies[symbol])
+
+        # Pairs are updated only with a full cross section of returns for the same open time
+        row = self.pending.setdefault(kline[0], {})
+        row[symbol] = r
+        if len(row) == len(self.symbols):
+            self.correlations.add([row[s] for s in self.symbols])
+            del self.pending[kline[0]]
+            # Older open times still pending will never be complete, some symbol has already moved past them
+            self._drop_pending(lambda open_time: open_time < kline[0])
+        elif len(self.pending) > self.max_pending:
+            oldest = min(self.pending)
+            self._drop_pending(lambda open_time: open_time == oldest)
+
+        stats = {'symbol': symbol, 'open_time': kline[0], 'return': r, 'sharpe': 0, 'sortino': 0, 'rank_corr': 0}
+        # Same as in data_processing - not enough returns yet gives 0
+        for key, fn in (('sharpe', ratios.sharpe), ('sortino', ratios.sortino), ('rank_corr', lambda: rank_corr.correlation)):
+            try:
+                stats[key] = fn()
+            except (AssertionError, ZeroDivisionError):
+                pass
+        return stats
+
+    def _drop_pending(self, is_stale: Callable[[int], bool]) -> None:
+        stale = [open_time for open_time in self.pending if is_stale(open_time)]
+        for open_time in stale:
+            del self.pending[open_time]
+        self.skipped += len(stale)
+
+    def correlation_matrix(self) -> np.ndarray:
+        """ Correlation matrix of the returns of all the symbols, in the order of the symbols """
+        return self.correlations.correlation
+
+
+async def stream_klines(cryptos: List[list],
+                        interval: str,
+                        cache: KlineCache = None,
+                        stats: LiveStatistics = None,
+                        url: str = STREAM_URL,
+                        on_update: Callable[[dict], None] = None,
+                        max_klines: int = None,
+                        reconnect: bool = True,
+                        reconnect_delay: float = 1.0) -> int:
+    """
+    params:
+        cryptos - crypto currencies, together with their market cap and supply, as from get_top_cryptoccy_by_market_cap
+        interval - frequency of the klines, eg. 1m, 1h, 1d
+        cache - optional KlineCache, where every closed kline is appended
+        stats - optional LiveStatistics, updated with every closed kline
+        url - base URL of the combined streams endpoint, eg. a local stand-in server for testing
+        on_update - optional callback called with the updated statistics of a symbol
+        max_klines - stop after that many closed klines, run forever by default
+        reconnect - reconnect when the connection is closed or dropped, otherwise stop
+        reconnect_delay - wait time in seconds before reconnecting, doubled on every failure in a row
+
+    Streams the klines of all the cryptocurrencies over one multiplexed WebSocket connection.
+    Only closed klines are used.
+    Returns the number of closed klines processed.
+    """
+    if websockets is None:
+        raise ImportError('Live streaming requires websockets to be installed.')
+
+    symbols = [ccy + 'USDT' for ccy, _, _ in cryptos]
+    count = 0
+    delay = reconnect_delay
+
+    while max_klines is None or count < max_klines:
+        try:
+            async with websockets.connect(stream_url(symbols, interval, url)) as ws:
+                delay = reconnect_delay
+                async for message in ws:
+                    event = parse_kline_event(message)
+                    if event is None:
+                        continue
+                    symbol, kline = event
+                    if cache is not None:
+                        cache.append(symbol, interval, [kline])
+                    if stats is not None:
+                        updated = stats.update(symbol, kline)
+                        if updated is not None and on_update is not None:
+                            on_update(updated)
+                    count += 1
+                    if max_klines is not None and count >= max_klines:
+                        return count
+        except (websockets.ConnectionClosed, OSError):
+            if not reconnect:
+                raise
+        if not reconnect:
+            return count
+        await asyncio.sleep(delay)
+        delay *= 2
+
+    return count
+
+
+def run_live(n: int, interval: str, cache_dir: str, window: int = None) -> None:
+    """
+    params:
+        n - number of top crypto currencies by market cap to be streamed
+        interval - frequency of the klines, eg. 1m, 1h, 1d
+        cache_dir - directory of the KlineCache
+        window - size of a fixed rolling window for the statistics, None for an expanding window
+
+    Streams the top n cryptocurrencies forever, appending the closed klines to the cache and printing the statistics.
+    """
+    from generic_helpers import get_top_cryptoccy_by_market_cap
+
+    cryptos = get_top_cryptoccy_by_market_cap(n)
+    stats = LiveStatistics(cryptos, window)
+    asyncio.run(stream_klines(cryptos, interval, KlineCache(cache_dir), stats, on_update=print))
@@ -1,29 +1,72 @@
-import datetime
 import json 
-import requests
-from generic_helpers import fix_time
-from typing import List
+import numpy as np
+from generic_helpers import date_to_epoch, supply_history
+from calendar_index import CalendarIndex, date_keys
+from kline_store import store_from_records
+from kline_downloader import KLINES_URL, MAX_LIMIT, fetch_all_klines
+from kline_records import empty_records, market_caps, to_payload_row
+from instrumentation import incr, logger, stage
+from typing import Dict, List
+
+def save_dataset(file_name:str,
+                 records:Dict[str, np.ndarray],
+                 supplies:Dict[str, float],
+                 supply_histories:Dict[str, tuple] = None) -> None:
+    """
+    params:
+        file_name - name of the JSON file to be saved
+        records - dictionary of crypto currency to its klines, as kline_records arrays sorted by open time
+        supplies - dictionary of crypto currency to its supply, for the market cap
+        supply_histories - optional dictionary of crypto currency to its supply history from the products snapshots,
+                           so the market cap of every kline uses the supply known as of that kline
+
+    Writes the dataset in the JSON format of load_data, symbol by symbol, so it is never built in memory as a whole.
+    As before, with more than one kline per day (eg. 1h frequency) the last kline of the day is kept.
+    """
+    with open(file_name, 'w') as f:
+        f.write('{')
+        for n, (ccy, klines) in enumerate(records.items()):
+            # Dates are formatted once per day, not per kline
+            calendar = CalendarIndex(klines['open_time'])
+            last = calendar.last_of_day()
+            caps = market_caps(klines[last], supplies[ccy], (supply_histories or {}).get(ccy)).tolist()
+            f.write(('' if n == 0 else ', ') + json.dumps(ccy) + ': {')
+            f.write(', '.join(f'{json.dumps(date)}: {json.dumps(to_payload_row(k, cap))}'
+                              for date, k, cap in zip(date_keys(klines['open_time'][last]).tolist(), klines[last], caps)))
+            f.write('}')
+        f.write('}')
 
 def load_data(cryptos:List[list], 
                start:str, 
                end:str, 
                frequency:str = '1d', 
-               limit:int = 1000, 
-               file_name:str = 'binance_data.json') -> dict:
+               limit:int = MAX_LIMIT, 
+               file_name:str = 'binance_data.json',
+               store_file_name:str = '',
+               max_workers:int = 8,
+               url:str = KLINES_URL,
+               snapshot_dir:str = '') -> Dict[str, np.ndarray]:
     """
     params:
         cryptos - dictionary of crypto currencies to extract data for, together with their market cap and supply
         start - begin of interval, in format YYYY-MM-DD
         end - end of interval, in format YYYY-MM-DD
         frequency - frequency to extract the data for, eg. every 1d, 1h, etc.
-        limit - the API has a limit of 1000 datapoint for response. TODO if that is exceeded.
+        limit - the API has a limit of 1000 datapoint for response. Longer intervals are fetched in pages of that size.
         file_name - Fesired name of a file to be saved locally.
+        store_file_name - optional name of a .npz file, where the columnar KlineStore is saved as well.
+        max_workers - max number of concurrent requests to the API.
+        url - URL of the klines endpoint, eg. a local stub server for testing.
+        snapshot_dir - optional directory with the products snapshots. If given, the market cap of every kline
+                       uses the supply as of that kline from the snapshots, instead of today's supply for all of them.
         
     The API used in this functoin has a limitation of the amount of data points to be extracte.
-    By default it is set to 500, so we increase that by default to 1000 for this function. Taking into
-    account the requirements, 1000 data points for 1D data is all enough for interval starting in beginning
-    of 2020, till mid 2021. In case that is used for larger periods/more granular time poitns, a functionality
-    to iterate and load this correctly has to be implemented!
+    By default it is set to 500, so we increase that by default to 1000 for this function.
+    For larger periods/more granular time points the data is loaded page by page - the start time of every
+    next request is right after the close time of the last data point received, until the end is reached.
+    Every page is parsed straight into compact records (see kline_records, 88 bytes per kline),
+    with no intermediate lists of strings. The JSON file and the store are written from the records at the end.
+    Returns dictionary of crypto currency to its klines, as kline_records arrays.
 
     Extract data from the binance public API based on a given cryptocurrency and interval.
     Output/payload should be as follow:
@@ -46,57 +89,55 @@ def load_data(cryptos:List[list],
     
     """
     
-    dataset = dict()
-    
     start = start.split('-')
     end = end.split('-')
-    url = "https://api.binance.com/api/v3/klines"
     if (len(start[0]) != 4) or (len(end[0]) != 4):
         raise ValueError('Incorrect year format. Please provide a valid date, eg. 2021!')
 
-    if datetime.datetime(int(start[0]),int(start[1]),int(start[2])) < datetime.datetime(2019, 12, 31):
-        raise ValueError('Invalid start date provided. Start date must be >= 2019-12-31!')
-    start = int(datetime.datetime(int(start[0]),int(start[1]),int(start[2])).timestamp()*1000)
+    # Midnight UTC, same as the open times of the daily candles, whatever the local timezone
+    start = date_to_epoch('-'.join(start))
+    end = date_to_epoch('-'.join(end))
+    if start > end:
+        raise ValueError('Invalid dates provided. Start date must be <= end date!')
 
-    # This is as of the time of dev of this function
-    if datetime.datetime(int(end[0]),int(end[1]),int(end[2])) > datetime.datetime(2021, 6, 10):
-        raise ValueError('Invalid end date provided. Start date must be <= 2021-06-10!')
-    end = int(datetime.datetime(int(end[0]),int(end[1]),int(end[2])).timestamp()*1000)
-    
-    # Iteration over the cryptocurrencies only. 
     # From the input date we need to access later the supply to get the monthly market cap,
     # but this can be done directly with hitting the value by index.
-    for i, ccy in enumerate([x[0] for x in cryptos]):
-        staging_ds = dict()
-        params = {
-            'symbol': ccy+'USDT',
-            'interval': frequency,
-            'startTime': start,
-            'endTime': end,
-            'limit': 1000
-        }
+    # With the snapshots, the historical supply is used, so the past market caps are not computed from today's supply.
+    histories = supply_history(snapshot_dir, [ccy for ccy, _, _ in cryptos]) if snapshot_dir else {}
+    tickers = {}
+    supplies = {}
+    pages = {}
+    for ccy, _, supply in cryptos:
+        tickers[ccy+'USDT'] = ccy
+        supplies[ccy] = float(supply)
+        pages[ccy] = []
 
-        res = requests.get(url, params=params, verify=False)
-        if res.status_code != 200:
-            raise Exception(f'Something went wrong with the GET request. MSG: {res.text}')
+    def add_page(symbol, page):
+        pages[tickers[symbol]].append(page)
+        incr('candles_parsed', len(page))
 
-        data = json.loads(res.text)
+    # All the cryptocurrencies are fetched concurrently, with a shared connection pool,
+    # rate limited to the Binance request weight limits and with retries on 429/5xx.
+    with stage('download'):
+        fetch_all_klines(list(tickers.keys()), frequency, start, end, limit, max_workers, url, on_page=add_page, records=True)
 
-        # Fix the epoch date and convert to a more structure dictionary
-        for d in data:
-            datestamp = fix_time(d[0])
-            staging_ds[datestamp] = d[1::]
-            supply = float(cryptos[i][2])
-            price = float(d[4])
-            market_cap = price * supply 
-            staging_ds[datestamp].append(market_cap)
-        
-        # Finally add the data for this crypto ccy in the dictionary
-        dataset[ccy] = staging_ds
+    # The pages of every symbol are joined and dropped right away, so only one copy of the klines is kept.
+    # Both the JSON file and the store are written from it.
+    dataset = {}
+    for ccy in supplies:
+        symbol_pages = pages.pop(ccy)
+        dataset[ccy] = np.concatenate(symbol_pages) if symbol_pages else empty_records()
+        del symbol_pages
     
     # Write the data to a file on the local FS. 
-    with open(file_name, 'w') as f:
-        json.dump(dataset, f)
+    with stage('save'):
+        save_dataset(file_name, dataset, supplies, histories)
         
-    print(f'Data loaded. File {file_name} saved on FS.')
+    logger.info(f'Data loaded. File {file_name} saved on FS.')
+
+    # The binary columnar version is much faster to load back for the statistics.
+    if store_file_name:
+        with stage('save'):
+            store_from_records(dataset, supplies, histories).save(store_file_name)
+        logger.info(f'Kline store {store_file_name} saved on FS.')
     return dataset
@@ -1,5 +1,6 @@
 from typing import List
 import math 
+from bisect import bisect_left, bisect_right, insort
 
 def mean(xs: List[float]) -> float:
     """
@@ -137,19 +138,162 @@ def rankdata(l: List[float]) -> List[float]:
     """
     Rank data based on a numeric list provided. 
     This handles duplicates using an average method. 
+    Sort based - every group of equal elements is next to each other after sorting,
+    so it gets the average of its positions.
     """
     if not l: return []
     if len(l) == 1: return [1]
-    l_sorted = sorted(l)
+    order = sorted(range(len(l)), key=l.__getitem__)
     l_ranked = [None] * len(l)
-    
-    for idx in range(len(l)):
-        if l.count(l[idx]) == 1:
-            l_ranked[l.index(l[idx])] = l_sorted.index(l[idx])+1
-            continue
-
-        xsum = sum([i+1 for i in range(len(l_sorted)) if l_sorted[i] == l[idx]])
-        xlen = len([i for i in range(len(l_sorted)) if l_sorted[i] == l[idx]])
-        l_ranked[idx] = xsum/xlen
-        
+
+    i = 0
+    while i < len(order):
+        j = i
+        while j + 1 < len(order) and l[order[j + 1]] == l[order[i]]:
+            j += 1
+        # Unique elements keep their integer position, ties get the average one
+        rank = i + 1 if i == j else (i + j + 2) / 2
+        for k in range(i, j + 1):
+            l_ranked[order[k]] = rank
+        i = j + 1
+
     return l_ranked
+
+
+class RankedSeries:
+    """
+    Order statistics of a series, which is only appended to.
+    Elements are kept in a sorted list, so the rank of any value is found with bisect in O(log n).
+    """
+
+    def __init__(self, xs: List[float] = None):
+        self.sorted = sorted(xs or [])
+
+    def __len__(self) -> int:
+        return len(self.sorted)
+
+    def append(self, x: float) -> None:
+        insort(self.sorted, x)
+
+    def remove(self, x: float) -> None:
+        """
+        params:
+            x - value that is in the series
+
+        Removes one occurrence of the value.
+        """
+        del self.sorted[bisect_left(self.sorted, x)]
+
+    def rank(self, x: float) -> float:
+        """
+        params:
+            x - value that is already in the series
+
+        Rank of the value, using the average method for duplicates - same as in rankdata.
+        """
+        lo = bisect_left(self.sorted, x)
+        hi = bisect_right(self.sorted, x)
+        return lo + 1 if hi - lo == 1 else (lo + hi + 1) / 2
+
+
+class RankCorrelation:
+    """
+    Spearman rank correlation of 2 series, which are appended to one pair of elements at a time,
+    eg. the market cap vs. return every month.
+
+    Ranks of both series are kept up to date - on every append only the new rank is found (with RankedSeries)
+    and the existing ranks are shifted, with no re-ranking (sorting) of the whole series.
+    Same result as correlation(rankdata(xs), rankdata(ys)).
+    Every append is O(n) in the number of elements kept, so with a fixed window the oldest pair is dropped
+    and the cost stays bounded. Without one the series (and the cost) grow with every append.
+    """
+
+    def __init__(self, window: int = None):
+        """
+        params:
+            window - max number of the latest pairs kept, None for all of them (expanding window)
+        """
+        assert window is None or window >= 2
+        self.window = window
+        self.xs = []
+        self.ys = []
+        self.x_ranks = []
+        self.y_ranks = []
+        self.x_series = RankedSeries()
+        self.y_series = RankedSeries()
+        self.sxx = 0.0
+        self.syy = 0.0
+        self.sxy = 0.0
+
+    def __len__(self) -> int:
+        return len(self.xs)
+
+    def _drop_oldest(self) -> None:
+        """ Removes the oldest pair, the ranks of the rest are shifted down """
+        x, y = self.xs.pop(0), self.ys.pop(0)
+        del self.x_ranks[0], self.y_ranks[0]
+        self.x_series.remove(x)
+        self.y_series.remove(y)
+        for i in range(len(self.xs)):
+            # Inverse of the shift in append - greater elements go 1 rank down, equal ones half a rank
+            if x < self.xs[i]:
+                self.x_ranks[i] -= 1
+            elif x == self.xs[i]:
+                self.x_ranks[i] -= 0.5
+            if y < self.ys[i]:
+                self.y_ranks[i] -= 1
+            elif y == self.ys[i]:
+                self.y_ranks[i] -= 0.5
+
+    def append(self, x: float, y: float) -> None:
+        """
+        params:
+            x - new element of the first series
+            y - new element of the second series
+        """
+        if self.window is not None and len(self.xs) == self.window:
+            self._drop_oldest()
+
+        sxx = syy = sxy = 0.0
+        for i in range(len(self.xs)):
+            # Greater elements go 1 rank up, equal ones half a rank (the average of the tie grows)
+            if x < self.xs[i]:
+                self.x_ranks[i] += 1
+            elif x == self.xs[i]:
+                self.x_ranks[i] += 0.5
+            if y < self.ys[i]:
+                self.y_ranks[i] += 1
+            elif y == self.ys[i]:
+                self.y_ranks[i] += 0.5
+            sxx += self.x_ranks[i] * self.x_ranks[i]
+            syy += self.y_ranks[i] * self.y_ranks[i]
+            sxy += self.x_ranks[i] * self.y_ranks[i]
+
+        self.x_series.append(x)
+        self.y_series.append(y)
+        rx = self.x_series.rank(x)
+        ry = self.y_series.rank(y)
+        self.xs.append(x)
+        self.ys.append(y)
+        self.x_ranks.append(rx)
+        self.y_ranks.append(ry)
+        self.sxx = sxx + rx * rx
+        self.syy = syy + ry * ry
+        self.sxy = sxy + rx * ry
+
+    @property
+    def correlation(self) -> float:
+        """
+        Same as math_helpers.correlation over the ranks - 0 if there is no variation.
+        """
+        n = len(self.xs)
+        # Must have at least 2 elements, same as math_helpers.variance
+        assert n >= 2
+        # The mean of the ranks is always (n + 1) / 2, ties included
+        c = n * ((n + 1) / 2) ** 2
+        sxx = self.sxx - c
+        syy = self.syy - c
+        if sxx > 0 and syy > 0:
+            return (self.sxy - c) / math.sqrt(sxx * syy)
+        else:
+            return 0
@@ -0,0 +1,113 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Dict, List, Tuple
+import numpy as np
+from stats_engine import monthly_statistics
+
+# Outputs of stats_engine.monthly_statistics, all with shape (symbols, months)
+OUTPUTS = ('returns', 'sharpe', 'sortino', 'rank_corr')
+
+
+def _shared_array(shape: tuple, dtype=np.float64) -> Tuple[shared_memory.SharedMemory, np.ndarray]:
+    """
+    params:
+        shape - shape of the array
+        dtype - type of the elements
+
+    New array backed by a shared memory block, which can be attached to from other processes by its name.
+    """
+    size = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+    shm = shared_memory.SharedMemory(create=True, size=size)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _attach(name: str, shape: tuple, dtype=np.float64) -> Tuple[shared_memory.SharedMemory, np.ndarray]:
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _compute_shard(names: Dict[str, str], shapes: Dict[str, tuple], lo: int, hi: int, MAR: float, RFR) -> None:
+    """
+    params:
+        names - names of the shared memory blocks of the inputs and outputs
+        shapes - shapes of the arrays in the shared memory blocks
+        lo - first symbol of the shard
+        hi - end (excluded) of the shard
+        MAR - minimum acceptance return for the Sortino Ratio
+        RFR - optional risk free rate per month for the Sharpe Ratio
+
+    Worker - computes the statistics for the symbols of the shard, reading the prices from
+    and writing the results to shared memory, so no arrays are pickled between the processes.
+    """
+    shms, arrays = {}, {}
+    for key in names:
+        shms[key], arrays[key] = _attach(names[key], shapes[key])
+    try:
+        stats = monthly_statistics(arrays['closes'][lo:hi], arrays['market_caps'][lo:hi], MAR, RFR)
+        for key in OUTPUTS:
+            arrays[key][lo:hi] = stats[key]
+    finally:
+        # Arrays must be released before the shared memory is closed
+        arrays.clear()
+        for shm in shms.values():
+            shm.close()
+
+
+def shards(n: int, workers: int) -> List[Tuple[int, int]]:
+    """
+    params:
+        n - number of symbols
+        workers - number of workers
+
+    Splits the symbols into contiguous shards of about the same size, one per worker.
+    """
+    bounds = np.linspace(0, n, min(workers, n) + 1).astype(int) if n else [0]
+    return [(int(lo), int(hi)) for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+
+
+def parallel_monthly_statistics(closes: np.ndarray,
+                                market_caps: np.ndarray,
+                                MAR: float = 0.0,
+                                RFR: np.ndarray = None,
+                                workers: int = None) -> Dict[str, np.ndarray]:
+    """
+    params:
+        closes - 2D array of the month end closes, shape (symbols, months + 1)
+        market_caps - 2D array of the month end market caps, same shape
+        MAR - minimum acceptance return for the Sortino Ratio
+        RFR - optional risk free rate per month for the Sharpe Ratio
+        workers - number of processes, all the CPUs by default
+
+    Same as stats_engine.monthly_statistics, but the symbols are sharded across a process pool.
+    The statistics of every symbol do not depend on the other symbols, so the shards are independent
+    and their results are merged by writing them to disjoint rows of the shared output arrays.
+    """
+    workers = workers or os.cpu_count() or 1
+    closes = np.asarray(closes, dtype=np.float64)
+    n, m = closes.shape[0], max(closes.shape[1] - 1, 0)
+    if workers == 1 or n < 2:
+        return monthly_statistics(closes, market_caps, MAR, RFR)
+
+    shapes = {'closes': closes.shape, 'market_caps': closes.shape}
+    shapes.update({key: (n, m) for key in OUTPUTS})
+    shms, arrays = {}, {}
+    for key, shape in shapes.items():
+        shms[key], arrays[key] = _shared_array(shape)
+    try:
+        arrays['closes'][:] = closes
+        arrays['market_caps'][:] = market_caps
+        names = {key: shm.name for key, shm in shms.items()}
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_compute_shard, names, shapes, lo, hi, MAR, RFR) for lo, hi in shards(n, workers)]
+            for future in futures:
+                future.result()
+
+        return {key: arrays[key].copy() for key in OUTPUTS}
+    finally:
+        # Arrays must be released before the shared memory is closed
+        arrays.clear()
+        for shm in shms.values():
+            shm.close()
+            shm.unlink()
@@ -0,0 +1,164 @@
+import re
+from typing import Dict, Tuple
+import numpy as np
+from kline_store import KlineStore
+from calendar_index import day_offsets, month_offsets
+
+# Supported periods - W(eek, starting Monday), M(onth), Q(uarter), Y(ear), or custom N days, eg. 7d
+PERIOD_PATTERN = re.compile(r'^(W|M|Q|Y|\d+d)$')
+
+
+def period_ids(open_time: np.ndarray, period: str) -> np.ndarray:
+    """
+    params:
+        open_time - open times of the candles, epoch in ms (UTC)
+        period - W, M, Q, Y or Nd, eg. 7d
+
+    Integer id of the period every candle belongs to, increasing with time.
+    Custom N day periods are counted from 1970-01-01.
+    """
+    if not PERIOD_PATTERN.match(period):
+        raise ValueError(f'Unsupported period: {period}. Must be one of W, M, Q, Y or Nd, eg. 7d')
+    days = day_offsets(open_time)
+
+    if period == 'W':
+        # 1970-01-01 is a Thursday, so shift by 3 days for weeks starting on Monday
+        return (days + 3) // 7
+    if period.endswith('d'):
+        return days // int(period[:-1])
+
+    months = month_offsets(open_time)
+    if period == 'M':
+        return months
+    if period == 'Q':
+        return months // 3
+    return months // 12
+
+
+def period_end(ids: np.ndarray, period: str) -> np.ndarray:
+    """
+    params:
+        ids - period ids from period_ids
+        period - the same period as for the ids
+
+    Last day of every period, as datetime64[D].
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    if period == 'W':
+        return (ids * 7 - 3 + 6).astype('datetime64[D]')
+    if period.endswith('d'):
+        n = int(period[:-1])
+        return ((ids + 1) * n - 1).astype('datetime64[D]')
+
+    months_per_period = {'M': 1, 'Q': 3, 'Y': 12}[period]
+    next_month = ((ids + 1) * months_per_period).astype('datetime64[M]')
+    return next_month.astype('datetime64[D]') - 1
+
+
+def ffill(values: np.ndarray) -> np.ndarray:
+    """
+    params:
+        values - 2D array, shape (symbols, time)
+
+    Forward fills the NaNs along the time axis with the last available value.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    idx = np.where(np.isnan(values), 0, np.arange(values.shape[1]))
+    np.maximum.accumulate(idx, axis=1, out=idx)
+    filled = np.take_along_axis(values, idx, axis=1)
+    return filled
+
+
+def _bounds(ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """ First and last (included) position of every period in the sorted ids """
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(ids)) + 1]) if len(ids) else np.array([], dtype=np.int64)
+    ends = np.concatenate([starts[1:], [len(ids)]]) - 1 if len(ids) else starts
+    return starts, ends
+
+
+def resample(open_time: np.ndarray,
+             columns: Dict[str, np.ndarray],
+             period: str) -> Dict[str, np.ndarray]:
+    """
+    params:
+        open_time - sorted open times of the candles, epoch in ms
+        columns - 2D arrays of the klines with shape (symbols, time), any of open, high, low, close, volume,
+                  trades, market_cap. Missing candles are NaN.
+        period - W, M, Q, Y or Nd, eg. 7d
+
+    Resamples the klines to bars of the given period, in one vectorized pass over the sorted open times.
+        open - first available open in the period
+        high - max of the highs, low - min of the lows
+        close, market_cap - last available close/market cap in the period, or before it if the period has none
+        volume, trades - sum over the period
+    Also returned are the period ids, the open time of the first candle in every period and the last day of every period.
+    """
+    open_time = np.asarray(open_time, dtype=np.int64)
+    ids = period_ids(open_time, period)
+    starts, ends = _bounds(ids)
+    out = {
+        'period': ids[starts],
+        'open_time': open_time[starts],
+        'period_end': period_end(ids[starts], period)
+    }
+    if not len(starts):
+        return {**out, **{field: np.asarray(col)[:, :0] for field, col in columns.items()}}
+
+    for field, col in columns.items():
+        col = np.asarray(col, dtype=np.float64)
+        if field in ('close', 'market_cap'):
+            out[field] = ffill(col)[:, ends]
+        elif field == 'open':
+            # First available open - backward fill, then drop the ones filled from a later period
+            idx = np.where(np.isnan(col), col.shape[1], np.arange(col.shape[1]))
+            idx = np.minimum.accumulate(idx[:, ::-1], axis=1)[:, ::-1]
+            first = idx[:, starts]
+            valid = first <= ends
+            padded = np.concatenate([col, np.full((col.shape[0], 1), np.nan)], axis=1)
+            out[field] = np.where(valid, np.take_along_axis(padded, first, axis=1), np.nan)
+        elif field == 'high':
+            out[field] = np.fmax.reduceat(col, starts, axis=1)
+        elif field == 'low':
+            out[field] = np.fmin.reduceat(col, starts, axis=1)
+        else:
+            out[field] = np.add.reduceat(np.nan_to_num(col), starts, axis=1)
+
+    return out
+
+
+def resample_store(store: KlineStore, period: str) -> Dict[str, np.ndarray]:
+    """
+    params:
+        store - KlineStore with the klines, eg. daily or hourly
+        period - W, M, Q, Y or Nd, eg. 7d
+
+    Resamples all the fields in the store to bars of the given period, see resample.
+    Trades are counted as 0 for the missing candles anyway, so they are just summed.
+    """
+    return resample(store.open_time, store.columns, period)
+
+
+def period_closes(store: KlineStore,
+                  dates: np.ndarray,
+                  period: str = 'M',
+                  fields: tuple = ('close',)) -> Dict[str, np.ndarray]:
+    """
+    params:
+        store - KlineStore with the klines
+        dates - dates (datetime64[D] or str in format YYYY-MM-DD) within the periods, eg. the month ends
+        period - W, M, Q, Y or Nd, eg. 7d
+        fields - close and/or market_cap
+
+    Last available value as of the end of the period of every date, shape (symbols, dates).
+    If a period has no candles at all, the last value before it is used. NaN if there is nothing before it.
+    """
+    bars = resample(store.open_time, {field: store.column(field) for field in fields}, period)
+    dates = np.asarray(dates, dtype='datetime64[D]')
+    ids = period_ids(dates.astype('datetime64[ms]').astype(np.int64), period)
+    pos = np.searchsorted(bars['period'], ids, side='right') - 1
+
+    out = {}
+    for field in fields:
+        padded = np.concatenate([bars[field], np.full((len(store.symbols), 1), np.nan)], axis=1)
+        out[field] = padded[:, np.where(pos >= 0, pos, padded.shape[1] - 1)]
+    return out
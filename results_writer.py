@@ -0,0 +1,172 @@
+import csv
+import importlib.util
+import json
+import os
+from typing import List
+import numpy as np
+
+FORMATS = ('parquet', 'csv')
+
+STATS_COLUMNS = ('month', 'symbol', 'return', 'sharpe', 'sortino', 'rank_corr')
+CORRELATIONS_COLUMNS = ('month', 'i', 'j', 'corr')
+
+
+def _pyarrow():
+    """
+    pyarrow is optional - without it the results are written as CSV files.
+    It is slow to import, so it is imported only once a parquet file is actually written or read.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError('Parquet format requires pyarrow to be installed.')
+    return pa, pq
+
+
+def default_format() -> str:
+    """ Parquet if pyarrow is available, CSV otherwise """
+    return 'parquet' if importlib.util.find_spec('pyarrow') is not None else 'csv'
+
+
+class ResultWriter:
+    """
+    Columnar writer of the monthly statistics and the pairs' returns correlations.
+
+    Results are streamed month by month, one file per month for each table, so nothing is kept in memory
+    and a single month can be loaded without parsing the rest:
+        directory/symbols.json - cryptocurrency tickers, the symbol indexes i, j of the correlations point in there
+        directory/stats/YYYY-MM-DD.<format> - (month, symbol) table with return, sharpe, sortino and rank_corr
+        directory/correlations/YYYY-MM-DD.<format> - (month, i, j) table with the correlation, i < j
+
+    """
+
+    def __init__(self, directory: str, symbols: List[str], fmt: str = None):
+        """
+        params:
+            directory - output directory, created if it does not exist
+            symbols - cryptocurrency tickers
+            fmt - parquet or csv, by default parquet if pyarrow is available
+        """
+        fmt = fmt or default_format()
+        if fmt not in FORMATS:
+            raise ValueError(f'Unsupported format: {fmt}. Must be one of {FORMATS}')
+        if fmt == 'parquet' and importlib.util.find_spec('pyarrow') is None:
+            raise ValueError('Parquet format requires pyarrow to be installed.')
+
+        self.directory = directory
+        self.symbols = list(symbols)
+        self.fmt = fmt
+        os.makedirs(os.path.join(directory, 'stats'), exist_ok=True)
+        os.makedirs(os.path.join(directory, 'correlations'), exist_ok=True)
+        with open(os.path.join(directory, 'symbols.json'), 'w') as f:
+            json.dump({'symbols': self.symbols, 'format': fmt}, f)
+
+    def _write(self, table: str, month: str, columns: dict) -> str:
+        path = os.path.join(self.directory, table, f'{month}.{self.fmt}')
+        if self.fmt == 'parquet':
+            pa, pq = _pyarrow()
+            pq.write_table(pa.table(columns), path)
+            return path
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(columns.keys())
+            writer.writerows(zip(*[c.tolist() if isinstance(c, np.ndarray) else c for c in columns.values()]))
+        return path
+
+    def write_stats(self,
+                    month: str,
+                    returns: np.ndarray,
+                    sharpe: np.ndarray,
+                    sortino: np.ndarray,
+                    rank_corr: np.ndarray) -> str:
+        """
+        params:
+            month - month end, in format YYYY-MM-DD
+            returns - 1M returns of all the symbols, in the order of the symbols
+            sharpe - Sharpe Ratios of all the symbols
+            sortino - Sortino Ratios of all the symbols
+            rank_corr - rank correlation coefficients (market cap vs. return) of all the symbols
+
+        Returns the path of the file written.
+        """
+        return self._write('stats', month, {
+            'month': [month] * len(self.symbols),
+            'symbol': self.symbols,
+            'return': np.asarray(returns, dtype=np.float64),
+            'sharpe': np.asarray(sharpe, dtype=np.float64),
+            'sortino': np.asarray(sortino, dtype=np.float64),
+            'rank_corr': np.asarray(rank_corr, dtype=np.float64)
+        })
+
+    def write_correlations(self, month: str, corr: np.ndarray) -> str:
+        """
+        params:
+            month - month end, in format YYYY-MM-DD
+            corr - correlation matrix of all the symbols, shape (symbols, symbols)
+
+        Returns the path of the file written.
+        """
+        i, j = np.triu_indices(len(self.symbols), 1)
+        return self._write('correlations', month, {
+            'month': [month] * len(i),
+            'i': i.astype(np.int32),
+            'j': j.astype(np.int32),
+            'corr': np.asarray(corr, dtype=np.float32)[i, j]
+        })
+
+
+def _read(path: str, fmt: str, columns: tuple, filters=None) -> dict:
+    if fmt == 'parquet':
+        _, pq = _pyarrow()
+        return pq.read_table(path, filters=filters).to_pydict()
+
+    with open(path, newline='') as f:
+        rows = list(csv.reader(f))[1:]
+    if filters:
+        # Same format as the pyarrow filters, only equality is supported here
+        rows = [r for r in rows if all(r[columns.index(c)] == str(v) for c, _, v in filters)]
+    out = {c: [r[k] for r in rows] for k, c in enumerate(columns)}
+    for c in columns:
+        if c in ('i', 'j'):
+            out[c] = [int(x) for x in out[c]]
+        elif c not in ('month', 'symbol'):
+            out[c] = [float(x) for x in out[c]]
+    return out
+
+
+def _months(directory: str, table: str) -> List[str]:
+    return sorted(os.path.splitext(f)[0] for f in os.listdir(os.path.join(directory, table)))
+
+
+def read_stats(directory: str, month: str = None, symbol: str = None) -> dict:
+    """
+    params:
+        directory - output directory of a ResultWriter
+        month - month end to be loaded, only this file is read
+        symbol - cryptocurrency to be loaded, all the months by default
+
+    Loads the statistics table as dictionary of column to list of values.
+    """
+    with open(os.path.join(directory, 'symbols.json')) as f:
+        fmt = json.load(f)['format']
+    filters = [('symbol', '=', symbol)] if symbol else None
+    out = {c: [] for c in STATS_COLUMNS}
+    for m in ([month] if month else _months(directory, 'stats')):
+        part = _read(os.path.join(directory, 'stats', f'{m}.{fmt}'), fmt, STATS_COLUMNS, filters)
+        for c in STATS_COLUMNS:
+            out[c].extend(part[c])
+    return out
+
+
+def read_correlations(directory: str, month: str) -> dict:
+    """
+    params:
+        directory - output directory of a ResultWriter
+        month - month end to be loaded
+
+    Loads the correlations of a single month as dictionary of column to list of values.
+    """
+    with open(os.path.join(directory, 'symbols.json')) as f:
+        fmt = json.load(f)['format']
+    return _read(os.path.join(directory, 'correlations', f'{month}.{fmt}'), fmt, CORRELATIONS_COLUMNS)
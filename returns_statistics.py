@@ -16,7 +16,8 @@ def sharpe_ratio(xs: List[float], p: int = 0, RFR: List[float] = []) -> float:
     # excess return
     r = subtract(xs, RFR)
     rm = mean(r)
-    s = standard_deviation(xs)
+    # Deviation of the excess returns, so a RFR changing over time counts as well
+    s = standard_deviation(r)
     # We annualize only if priod is > 1 Year
     if p > 12:
         rm = annualize(rm, p)
@@ -0,0 +1,306 @@
+import math
+from bisect import bisect_left, insort
+from typing import Callable, Dict, Tuple
+import numpy as np
+from stats_engine import _first_valid, _rolling_sum, period_returns, rolling_moments
+
+
+def rolling_volatility(returns: np.ndarray, window: int = None, periods_per_year: int = None) -> np.ndarray:
+    """
+    params:
+        returns - 2D array of returns, shape (symbols, periods)
+        window - number of periods in the window, None for an expanding window
+        periods_per_year - optional number of periods in a year (eg. 365 for daily returns), to annualize the volatility
+
+    Standard deviation of the returns over the window ending at every period, NaN with less than 2 returns.
+    The first window - 1 periods use all the returns available so far.
+    """
+    _, _, var = rolling_moments(returns, window)
+    vol = np.sqrt(var)
+    return vol * math.sqrt(periods_per_year) if periods_per_year else vol
+
+
+def rolling_sharpe(returns: np.ndarray,
+                   window: int = None,
+                   RFR: np.ndarray = None,
+                   periods_per_year: int = None) -> np.ndarray:
+    """
+    params:
+        returns - 2D array of returns, shape (symbols, periods)
+        window - number of periods in the window, None for an expanding window
+        RFR - optional risk free rate per period, shape (periods,) or the shape of the returns
+        periods_per_year - optional number of periods in a year (eg. 365 for daily returns), to annualize the ratio
+
+    Sharpe Ratio over the window ending at every period, from the mean and the standard deviation
+    of the excess returns, so a risk free rate changing over time is fully accounted for.
+    Per period by default, otherwise multiplied by sqrt(periods_per_year), same as the volatility. Undefined ratios are 0.
+    """
+    returns = np.asarray(returns, dtype=np.float64)
+    excess = returns if RFR is None else returns - np.broadcast_to(RFR, returns.shape)
+    _, m, var = rolling_moments(excess, window)
+    s = np.sqrt(var)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ratio = m / s
+    if periods_per_year:
+        ratio = ratio * math.sqrt(periods_per_year)
+    return np.where(np.isfinite(ratio) & (s > 0), ratio, 0.0)
+
+
+class SlidingAggregate:
+    """
+    Sliding window aggregation with 2 stacks - amortized O(1) per step for any associative combine function.
+
+    The values are NumPy arrays (eg. one value per symbol), so all the symbols are aggregated in lockstep
+    with vectorized combines. Same idea as a monotonic deque for the sliding max, but it also works
+    for aggregates like the max drawdown, which need more than the extreme of the window.
+
+    """
+
+    def __init__(self, combine: Callable):
+        """
+        params:
+            combine - associative function of 2 aggregates, the older one first
+        """
+        self.combine = combine
+        # Front - oldest value on top, every entry aggregates itself and all the newer ones in the front
+        self.front = []
+        # Back - newest values, with the aggregate of all of them
+        self.back = []
+        self.back_agg = None
+
+    def __len__(self) -> int:
+        return len(self.front) + len(self.back)
+
+    def push(self, value) -> None:
+        """ Adds the newest value """
+        self.back.append(value)
+        self.back_agg = value if self.back_agg is None else self.combine(self.back_agg, value)
+
+    def pop(self) -> None:
+        """ Removes the oldest value """
+        if not self.front:
+            agg = None
+            for value in reversed(self.back):
+                agg = value if agg is None else self.combine(value, agg)
+                self.front.append(agg)
+            self.back = []
+            self.back_agg = None
+        self.front.pop()
+
+    def query(self):
+        """ Aggregate of all the values in the window, in order """
+        assert len(self) > 0
+        if not self.front:
+            return self.back_agg
+        if self.back_agg is None:
+            return self.front[-1]
+        return self.combine(self.front[-1], self.back_agg)
+
+
+def _sliding(values: np.ndarray, window: int, leaf: Callable, combine: Callable, result: Callable) -> np.ndarray:
+    """ Aggregate of the window ending at every period, for all the rows of values at once """
+    agg = SlidingAggregate(combine)
+    out = np.empty(values.shape)
+    for t in range(values.shape[1]):
+        agg.push(leaf(values[:, t]))
+        if window is not None and len(agg) > window:
+            agg.pop()
+        out[:, t] = result(agg.query())
+    return out
+
+
+def _drawdown_combine(a: tuple, b: tuple) -> tuple:
+    """ (max, min, max drawdown) of 2 consecutive segments, NaN (missing) values are ignored """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        across = b[1] / a[0] - 1
+    return np.fmax(a[0], b[0]), np.fmin(a[1], b[1]), np.fmin(np.fmin(a[2], b[2]), across)
+
+
+def rolling_max(closes: np.ndarray, window: int = None) -> np.ndarray:
+    """
+    params:
+        closes - 2D array of closes, shape (symbols, periods). Missing closes are NaN.
+        window - number of periods in the window, None for an expanding window
+
+    Highest close over the window ending at every period.
+    """
+    closes = np.asarray(closes, dtype=np.float64)
+    if window is None:
+        return np.fmax.accumulate(closes, axis=1)
+    return _sliding(closes, window, lambda x: x, np.fmax, lambda a: a)
+
+
+def drawdown(closes: np.ndarray, window: int = None) -> np.ndarray:
+    """
+    params:
+        closes - 2D array of closes, shape (symbols, periods)
+        window - number of periods in the window, None for the all time high
+
+    Current drawdown of every symbol as of every period - the close relative to the highest close in the window, <= 0.
+    """
+    closes = np.asarray(closes, dtype=np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return closes / rolling_max(closes, window) - 1
+
+
+def rolling_max_drawdown(closes: np.ndarray, window: int = None) -> np.ndarray:
+    """
+    params:
+        closes - 2D array of closes, shape (symbols, periods). Missing closes are NaN.
+        window - number of periods in the window, None for an expanding window
+
+    Max drawdown over the window ending at every period - the largest drop from a peak to a later trough,
+    both within the window, as a fraction <= 0, eg. -0.35. NaN if there is no close in the window.
+    Every step is amortized O(1), with the (max, min, max drawdown) of the window kept in a SlidingAggregate.
+    """
+    closes = np.asarray(closes, dtype=np.float64)
+    leaf = lambda x: (x, x, np.where(np.isnan(x), np.nan, 0.0))
+    return _sliding(closes, window, leaf, _drawdown_combine, lambda a: a[2])
+
+
+def cap_weights(market_caps: np.ndarray) -> np.ndarray:
+    """
+    params:
+        market_caps - 2D array of the market caps as of every close, shape (symbols, periods + 1)
+
+    Weights of a market cap weighted index for every period, from the market caps at its start, shape (symbols, periods).
+    Symbols with no market cap (NaN) are left out.
+    """
+    caps = np.nan_to_num(np.asarray(market_caps, dtype=np.float64)[:, :-1])
+    totals = caps.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(totals > 0, caps / totals, 0.0)
+
+
+def index_returns(returns: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """
+    params:
+        returns - 2D array of returns, shape (symbols, periods)
+        weights - 2D array of the index weights, same shape, eg. from cap_weights
+
+    Returns of the index, shape (periods,). Missing returns are left out.
+    """
+    return (np.nan_to_num(np.asarray(returns, dtype=np.float64)) * weights).sum(axis=0)
+
+
+def rolling_beta(returns: np.ndarray, benchmark: np.ndarray, window: int = None) -> np.ndarray:
+    """
+    params:
+        returns - 2D array of returns, shape (symbols, periods)
+        benchmark - returns of the benchmark, shape (periods,), eg. the BTC returns or index_returns
+        window - number of periods in the window, None for an expanding window
+
+    Beta of every symbol against the benchmark over the window ending at every period - cov(r, b) / var(b),
+    over the periods where both returns are available. NaN with less than 2 of them or no variation of the benchmark.
+    """
+    xs = np.asarray(returns, dtype=np.float64)
+    ys = np.broadcast_to(np.asarray(benchmark, dtype=np.float64), xs.shape)
+    valid = ~np.isnan(xs) & ~np.isnan(ys)
+    # Covariance is shift invariant as well
+    x = np.where(valid, xs - _first_valid(xs), 0.0)
+    y = np.where(valid, ys - _first_valid(np.where(valid, ys, np.nan)), 0.0)
+    n = _rolling_sum(valid.astype(np.float64), window)
+    sx, sy = _rolling_sum(x, window), _rolling_sum(y, window)
+    sxy, syy = _rolling_sum(x * y, window), _rolling_sum(y * y, window)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cov = sxy - sx * sy / n
+        var = syy - sy * sy / n
+        beta = cov / var
+    # Relative tolerance, so that a constant benchmark gives NaN instead of the rounding noise of the sums
+    return np.where((n >= 2) & (var > 1e-12 * syy), beta, np.nan)
+
+
+def _window_tail(row: list, window: int, level: float) -> Tuple[list, list]:
+    """ VaR and CVaR of a single series, with the window kept sorted and updated in place """
+    ordered = []
+    var, cvar = [], []
+    for t, r in enumerate(row):
+        # NaN != NaN - missing returns are not in the window
+        if r == r:
+            insort(ordered, r)
+        if window is not None and t >= window:
+            old = row[t - window]
+            if old == old:
+                del ordered[bisect_left(ordered, old)]
+        n = len(ordered)
+        if n == 0:
+            var.append(math.nan)
+            cvar.append(math.nan)
+            continue
+        worst = max(math.ceil((1 - level) * n - 1e-9), 1)
+        var.append(-ordered[worst - 1])
+        cvar.append(-sum(ordered[:worst]) / worst)
+    return var, cvar
+
+
+def historical_var(returns: np.ndarray, window: int = None, level: float = 0.95) -> Dict[str, np.ndarray]:
+    """
+    params:
+        returns - 2D array of returns, shape (symbols, periods). Missing returns are NaN.
+        window - number of periods in the window, None for an expanding window
+        level - confidence level, eg. 0.95
+
+    Historical Value at Risk and Conditional Value at Risk (expected shortfall) over the window ending at every period,
+    as positive losses. Out of the n returns in the window the k = ceil((1 - level) * n) worst ones are taken:
+        var - loss of the k-th worst return
+        cvar - average loss of the k worst returns
+    NaN if there are no returns in the window.
+    The window of every symbol is kept sorted - on every step the new return is inserted and the one leaving
+    the window is removed with bisect, so nothing is re-sorted (O(log w) search and an O(w) memmove per step).
+    """
+    assert 0 < level < 1
+    returns = np.asarray(returns, dtype=np.float64)
+    out = {'var': np.full(returns.shape, np.nan), 'cvar': np.full(returns.shape, np.nan)}
+    for i, row in enumerate(returns.tolist()):
+        out['var'][i], out['cvar'][i] = _window_tail(row, window, level)
+    return out
+
+
+def risk_metrics(closes: np.ndarray,
+                 market_caps: np.ndarray = None,
+                 window: int = None,
+                 benchmark: int = None,
+                 level: float = 0.95,
+                 RFR: np.ndarray = None,
+                 periods_per_year: int = None) -> Dict[str, np.ndarray]:
+    """
+    params:
+        closes - 2D array of closes, shape (symbols, periods + 1), eg. daily or month end closes
+        market_caps - 2D array of the market caps as of the same closes, for the market cap weighted index
+        window - number of periods (returns) in the rolling window, None for an expanding window
+        benchmark - row of the benchmark symbol for the beta, eg. the one of BTC.
+                    By default the market cap weighted index of all the symbols.
+        level - confidence level of the VaR and CVaR
+        RFR - optional risk free rate per period for the Sharpe Ratio, shape (periods,) or (symbols, periods)
+        periods_per_year - optional number of periods in a year, to annualize the volatility and the Sharpe Ratio
+
+    Computes all the risk metrics at once for the whole symbols x periods matrix, same as monthly_statistics.
+    Every output array has shape (symbols, periods):
+        returns - period returns
+        volatility - standard deviation of the returns in the window
+        sharpe - Sharpe Ratio over the window, with the time varying RFR
+        max_drawdown - max drawdown of the closes in the window (the close before the first return included)
+        beta - beta against the benchmark
+        var, cvar - historical Value at Risk and Conditional Value at Risk, as positive losses
+    """
+    closes = np.asarray(closes, dtype=np.float64)
+    returns = period_returns(closes)
+    if benchmark is not None:
+        bench = returns[benchmark]
+    else:
+        if market_caps is None:
+            raise ValueError('Market caps are needed for the market cap weighted index benchmark.')
+        bench = index_returns(returns, cap_weights(market_caps))
+
+    # A window of n returns spans n + 1 closes
+    max_drawdown = rolling_max_drawdown(closes, None if window is None else window + 1)[:, 1:]
+    var = historical_var(returns, window, level)
+    return {
+        'returns': returns,
+        'volatility': rolling_volatility(returns, window, periods_per_year),
+        'sharpe': rolling_sharpe(returns, window, RFR, periods_per_year),
+        'max_drawdown': max_drawdown,
+        'beta': rolling_beta(returns, bench, window),
+        'var': var['var'],
+        'cvar': var['cvar']
+    }
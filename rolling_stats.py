@@ -0,0 +1,274 @@
+from collections import deque
+from typing import List
+import math
+import numpy as np
+from math_helpers import annualize
+
+
+class RunningMoments:
+    """
+    Mean and variance of a series, updated in O(1) for every new element (Welford's algorithm).
+
+    By default the window is expanding - all elements ingested so far are used.
+    With a window size given, only the last "window" elements are used and the oldest one is removed
+    from the moments with the reverse update, once the window is full.
+
+    """
+
+    def __init__(self, window: int = None):
+        """
+        params:
+            window - size of a fixed rolling window, None for an expanding window
+        """
+        assert window is None or window > 0
+        self.window = window
+        self.values = deque()
+        self.n = 0
+        self.m = 0.0
+        self.m2 = 0.0
+
+    def add(self, x: float) -> None:
+        """
+        params:
+            x - new element of the series
+        """
+        if self.window is not None:
+            self.values.append(x)
+        self.n += 1
+        d = x - self.m
+        self.m += d / self.n
+        self.m2 += d * (x - self.m)
+
+        if self.window is not None and self.n > self.window:
+            self.remove(self.values.popleft())
+
+    def remove(self, x: float) -> None:
+        """
+        params:
+            x - element to be removed, must be one that was added before
+
+        Reverse of the Welford update.
+        """
+        assert self.n > 0
+        self.n -= 1
+        if self.n == 0:
+            self.m = 0.0
+            self.m2 = 0.0
+            return
+        m_after = self.m - (x - self.m) / self.n
+        self.m2 -= (x - m_after) * (x - self.m)
+        self.m = m_after
+
+    @property
+    def mean(self) -> float:
+        assert self.n > 0
+        return self.m
+
+    @property
+    def variance(self) -> float:
+        # Must have at least 2 elements, same as math_helpers.variance
+        assert self.n >= 2
+        return max(self.m2, 0.0) / (self.n - 1)
+
+    @property
+    def standard_deviation(self) -> float:
+        return math.sqrt(self.variance)
+
+
+class RunningRatios:
+    """
+    Sharpe and Sortino Ratios of a return series, updated in O(1) for every new return.
+
+    Results are the same as sharpe_ratio(xs, len(xs), RFR) and sortino_ratio(xs, len(xs), MAR)
+    over the returns in the window, including the AssertionError when there are not enough returns.
+
+    """
+
+    def __init__(self, window: int = None, MAR: float = 0.0):
+        """
+        params:
+            window - size of a fixed rolling window, None for an expanding window
+            MAR - minimum acceptance return for the Sortino Ratio
+        """
+        self.window = window
+        self.MAR = MAR
+        self.returns = RunningMoments()
+        self.excess = RunningMoments()
+        self.downside = RunningMoments()
+        self.values = deque()
+
+    def add(self, x: float, rfr: float = 0.0) -> None:
+        """
+        params:
+            x - new return
+            rfr - risk free rate for the same period
+        """
+        self._update(x, rfr, 1)
+        if self.window is not None:
+            self.values.append((x, rfr))
+            if len(self.values) > self.window:
+                self._update(*self.values.popleft(), -1)
+
+    def _update(self, x: float, rfr: float, direction: int) -> None:
+        update = (lambda acc, v: acc.add(v)) if direction > 0 else (lambda acc, v: acc.remove(v))
+        update(self.returns, x)
+        update(self.excess, x - rfr)
+        if x < self.MAR:
+            update(self.downside, x)
+
+    @property
+    def count(self) -> int:
+        return self.returns.n
+
+    def sharpe(self) -> float:
+        """ Sharpe Ratio over the returns in the window """
+        p = self.count
+        rm = self.excess.mean
+        s = self.excess.standard_deviation
+        # We annualize only if priod is > 1 Year
+        if p > 12:
+            rm = annualize(rm, p)
+            s = s * math.sqrt(12)
+        return rm / s
+
+    def sortino(self) -> float:
+        """ Sortino Ratio over the returns in the window """
+        if self.downside.n == 0:
+            return 0
+        p = self.count
+        rm = self.downside.mean - self.MAR
+        s = self.downside.standard_deviation
+        # We annualize only if priod is > 1 Year
+        if p > 12:
+            rm = annualize(rm, p)
+            s = s * math.sqrt(12)
+        return rm / s
+
+
+class RunningCovariance:
+    """
+    Covariance and correlation of a pair of series, updated in O(1) for every new pair of elements.
+
+    """
+
+    def __init__(self, window: int = None):
+        """
+        params:
+            window - size of a fixed rolling window, None for an expanding window
+        """
+        self.window = window
+        self.xs = RunningMoments()
+        self.ys = RunningMoments()
+        self.c = 0.0
+        self.values = deque()
+
+    def add(self, x: float, y: float) -> None:
+        """
+        params:
+            x - new element of the first series
+            y - new element of the second series
+        """
+        my = self.ys.m
+        self.xs.add(x)
+        self.ys.add(y)
+        self.c += (x - self.xs.m) * (y - my)
+
+        if self.window is not None:
+            self.values.append((x, y))
+            if len(self.values) > self.window:
+                self.remove(*self.values.popleft())
+
+    def remove(self, x: float, y: float) -> None:
+        """
+        params:
+            x - element of the first series to be removed
+            y - element of the second series to be removed
+        """
+        my = self.ys.m
+        self.xs.remove(x)
+        self.ys.remove(y)
+        if self.xs.n == 0:
+            self.c = 0.0
+            return
+        self.c -= (x - self.xs.m) * (y - my)
+
+    @property
+    def covariance(self) -> float:
+        assert self.xs.n >= 2
+        return self.c / (self.xs.n - 1)
+
+    @property
+    def correlation(self) -> float:
+        """ Same as math_helpers.correlation - 0 if there is no variation """
+        stdev_x = self.xs.standard_deviation
+        stdev_y = self.ys.standard_deviation
+        if stdev_x > 0 and stdev_y > 0:
+            return self.covariance / stdev_x / stdev_y
+        return 0
+
+
+class RunningCovarianceMatrix:
+    """
+    Covariance and correlation matrices of N series, updated with one vector of N elements at a time.
+    Every update is O(N^2), i.e. O(1) per pair.
+
+    """
+
+    def __init__(self, n: int, window: int = None):
+        """
+        params:
+            n - number of series, eg. cryptocurrencies
+            window - size of a fixed rolling window, None for an expanding window
+        """
+        self.window = window
+        self.count = 0
+        self.m = np.zeros(n)
+        self.c = np.zeros((n, n))
+        self.values = deque()
+
+    def add(self, xs: List[float]) -> None:
+        """
+        params:
+            xs - new elements of all the series, eg. the returns of all cryptocurrencies for a month
+        """
+        xs = np.asarray(xs, dtype=np.float64)
+        self.count += 1
+        d = xs - self.m
+        self.m += d / self.count
+        self.c += np.outer(d, xs - self.m)
+
+        if self.window is not None:
+            self.values.append(xs)
+            if len(self.values) > self.window:
+                self.remove(self.values.popleft())
+
+    def remove(self, xs: np.ndarray) -> None:
+        """
+        params:
+            xs - elements of all the series to be removed
+        """
+        assert self.count > 0
+        self.count -= 1
+        if self.count == 0:
+            self.m[:] = 0.0
+            self.c[:] = 0.0
+            return
+        m_after = self.m - (xs - self.m) / self.count
+        self.c -= np.outer(xs - m_after, xs - self.m)
+        self.m = m_after
+
+    @property
+    def covariance(self) -> np.ndarray:
+        assert self.count >= 2
+        return self.c / (self.count - 1)
+
+    @property
+    def correlation(self) -> np.ndarray:
+        """ Same as stats_engine.correlation_matrix - 0 if there is no variation or less than 2 elements """
+        n = len(self.m)
+        if self.count < 2:
+            return np.zeros((n, n))
+        sd = np.sqrt(np.maximum(np.diag(self.c), 0.0))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            corr = self.c / np.outer(sd, sd)
+        return np.where(np.outer(sd, sd) > 0, corr, 0.0)
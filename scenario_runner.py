@@ -0,0 +1,254 @@
+import datetime
+import itertools
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+import numpy as np
+from calendar_index import month_end_dates
+from kline_store import load_kline_store
+from resample import period_closes
+from stats_engine import (correlation_matrix, expanding_rank_correlation, expanding_sharpe, expanding_sortino,
+                          period_returns, top_correlated_pairs)
+from instrumentation import incr, stage
+
+# Parameters of a scenario and their defaults, see ScenarioRunner.run_scenario
+SCENARIO_DEFAULTS = {'start': None, 'end': None, 'n': None, 'MAR': 0.0, 'RFR': None}
+
+
+def scenario_grid(**params) -> List[dict]:
+    """
+    params:
+        params - list of values for any of the scenario parameters - start, end, n, MAR, RFR
+
+    All the combinations of the parameters, eg. scenario_grid(start=['2020-1-31'], end=['2020-12-31', '2021-5-31'], n=[5, 10])
+    gives 4 scenarios.
+    """
+    unknown = set(params) - set(SCENARIO_DEFAULTS)
+    if unknown:
+        raise ValueError(f'Unknown scenario parameters: {", ".join(sorted(unknown))}')
+    keys = list(params)
+    return [dict(zip(keys, values)) for values in itertools.product(*(params[k] for k in keys))]
+
+
+class LRUCache:
+    """
+    Thread safe least recently used cache of computed values, with at most maxsize entries.
+
+    """
+
+    def __init__(self, maxsize: int = 32):
+        """
+        params:
+            maxsize - max number of entries, the least recently used one is evicted above it
+        """
+        assert maxsize > 0
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key, compute: Callable[[], object]):
+        """
+        params:
+            key - hashable key of the value
+            compute - function computing the value if it is not cached
+
+        Cached value of the key, computed and cached if missing.
+        The value is computed outside of the lock, so concurrent misses of the same key may compute it twice.
+        """
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                incr('scenario_cache_hits')
+                return self.entries[key]
+
+        incr('scenario_cache_misses')
+        value = compute()
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return value
+
+
+def _parse_date(date: str) -> datetime.date:
+    parts = date.split('-')
+    if len(parts[0]) != 4:
+        raise ValueError('Incorrect year format. Please provide a valid date, eg. 2021!')
+    return datetime.date(int(parts[0]), int(parts[1]), int(parts[2]))
+
+
+class ScenarioRunner:
+    """
+    Runs many scenarios of the monthly statistics (different start/end windows, universe sizes, MAR and RFR)
+    over one dataset, which is loaded only once.
+
+    The month end closes and market caps are computed once for all the months of the data, and every scenario is a slice of them.
+    The statistics are expanding from the start month and every symbol is independent of the others, so the returns
+    and the rank correlations (the expensive part) are cached per start month, for all the symbols and up to the last
+    month of the data - any end and universe size starting in the same month is served from the cache.
+
+    """
+
+    def __init__(self, file_name: str, cache_size: int = 32):
+        """
+        params:
+            file_name - the binary .npz KlineStore or the JSON dataset from load_data
+            cache_size - max number of cached intermediates (per start month), least recently used ones are evicted
+        """
+        self.store = load_kline_store(file_name, fields=('close', 'market_cap'))
+        if len(self.store.open_time) == 0:
+            raise ValueError('No data found in the file provided.')
+        self.first_date = self.store.calendar.first_date
+        self.last_date = self.store.calendar.last_date
+        self.last_full_date = self.store.calendar.last_full_date
+        self.cache = LRUCache(cache_size)
+
+        # Month ends of all the months in the data, the first one is the end of the first month.
+        # A last month the data ends partway through (up to the close of the month end day) has no month end close yet,
+        # so it is left out.
+        months = np.arange(np.datetime64(self.first_date, 'M'), np.datetime64(self.last_date, 'M') + 1)
+        month_ends = (months + 1).astype('datetime64[D]') - 1
+        self.month_ends = month_ends[month_ends <= np.datetime64(self.last_full_date, 'D')]
+        with stage('month_ends'):
+            month_end = period_closes(self.store, self.month_ends, 'M', ('close', 'market_cap'))
+        self.closes = month_end['close']
+        self.market_caps = month_end['market_cap']
+
+    def _month_position(self, date: datetime.date) -> int:
+        return int(np.searchsorted(self.month_ends, np.datetime64(date, 'D')))
+
+    def returns(self, first: int) -> np.ndarray:
+        """
+        params:
+            first - position of the first month end (the previous month end of the first return)
+
+        1M returns of all the symbols from that month end to the last month of the data.
+        """
+        return self.cache.get(('returns', first), lambda: period_returns(self.closes[:, first:]))
+
+    def rank_correlations(self, first: int) -> np.ndarray:
+        """
+        params:
+            first - position of the first month end
+
+        Expanding rank correlations (market cap vs. return) of all the symbols from that month end.
+        """
+        def compute():
+            with stage('rank_correlations'):
+                return expanding_rank_correlation(self.returns(first), self.market_caps[:, first + 1:])
+        return self.cache.get(('rank_corr', first), compute)
+
+    def run_scenario(self,
+                     start: str,
+                     end: str,
+                     n: int = None,
+                     MAR: float = 0.0,
+                     RFR=None) -> Dict[str, object]:
+        """
+        params:
+            start - begin of interval for 1M returns to compute, in format YYYY-MM-DD
+            end - end of interval for 1M returns to compute, in format YYYY-MM-DD.
+                  A last month the data ends partway through is left out, same as in get_monthly_returns_and_statistics.
+            n - universe size - the top n cryptocurrencies by market cap as of the first month end
+                (known at the start of the first return), all of them by default
+            MAR - minimum acceptance return for the Sortino Ratio
+            RFR - optional risk free rate per month for the Sharpe Ratio, a number or one value per month of the scenario
+
+        Same statistics as get_monthly_returns_and_statistics for the scenario, as arrays with shape (symbols, months):
+            dates - month ends, the first one is the previous month end of the first month
+            symbols - cryptocurrencies in the universe, by market cap
+            returns, sharpe, sortino, rank_corr - same as from stats_engine.monthly_statistics
+            correlation - correlation matrix of the returns as of the last month
+            top_pair - pair with max correlation as of the last month
+        """
+        start_date, end_date = _parse_date(start), _parse_date(end)
+        if start_date < self.first_date:
+            raise ValueError(f'Invalid start date provided. Start date must be >= {self.first_date}!')
+        if end_date > self.last_date:
+            raise ValueError(f'Invalid end date provided. End date must be <= {self.last_date}!')
+
+        dates = month_end_dates(start_date, end_date, self.last_full_date)
+        if len(dates) < 2:
+            raise ValueError('At least one full month is needed between the start and the end date.')
+        first = self._month_position(dates[0])
+        months = len(dates) - 1
+
+        # Universe as of the first month end, largest market cap first, ties in the order of the store
+        caps = np.nan_to_num(self.market_caps[:, first], nan=-np.inf)
+        rows = np.argsort(-caps, kind='stable')[:n]
+        closes = self.closes[rows, first:first + months + 1]
+        if np.isnan(closes).any():
+            missing = sorted({self.store.symbols[rows[i]] for i in np.flatnonzero(np.isnan(closes).any(axis=1))})
+            raise ValueError(f'No data available as of some of the month ends for: {", ".join(missing)}')
+
+        returns = self.returns(first)[rows, :months]
+        if RFR is not None and np.ndim(RFR) == 0:
+            RFR = np.full(months, float(RFR))
+        symbols = [self.store.symbols[i] for i in rows]
+        with stage('scenario'):
+            corr = correlation_matrix(returns)
+            result = {
+                'dates': np.datetime_as_string(dates, unit='D').tolist(),
+                'symbols': symbols,
+                'returns': returns,
+                'sharpe': expanding_sharpe(returns, RFR),
+                'sortino': expanding_sortino(returns, MAR),
+                'rank_corr': self.rank_correlations(first)[rows, :months],
+                'correlation': corr,
+                'top_pair': top_correlated_pairs(corr, symbols, 1)[0] if len(symbols) > 1 else None
+            }
+        return result
+
+    def run(self, scenarios: List[dict], workers: int = None) -> List[Dict[str, object]]:
+        """
+        params:
+            scenarios - parameters of every scenario, eg. from scenario_grid
+            workers - number of threads the scenarios are run on, all the CPUs by default
+
+        Runs all the scenarios, returns their results in the same order.
+        Scenarios are independent, so they are run in parallel threads sharing the loaded data and the cache
+        (NumPy releases the GIL in the heavy operations). Scenarios with the same start month are run together,
+        so the intermediates of a start month are computed once and used while still in the cache.
+        """
+        for scenario in scenarios:
+            unknown = set(scenario) - set(SCENARIO_DEFAULTS)
+            if unknown:
+                raise ValueError(f'Unknown scenario parameters: {", ".join(sorted(unknown))}')
+
+        def run_group(group):
+            return [(i, self.run_scenario(**{**SCENARIO_DEFAULTS, **scenarios[i]})) for i in group]
+
+        # Grouped by the start month
+        groups = {}
+        for i, scenario in enumerate(scenarios):
+            key = np.datetime64(_parse_date(scenario['start']), 'M')
+            groups.setdefault(key, []).append(i)
+
+        results = [None] * len(scenarios)
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+            for future in [executor.submit(run_group, group) for group in groups.values()]:
+                for i, result in future.result():
+                    results[i] = result
+        return results
+
+
+def run_scenarios(file_name: str,
+                  scenarios: List[dict],
+                  workers: int = None,
+                  cache_size: int = 32) -> List[Dict[str, object]]:
+    """
+    params:
+        file_name - the binary .npz KlineStore or the JSON dataset from load_data
+        scenarios - parameters of every scenario, eg. from scenario_grid
+        workers - number of threads the scenarios are run on, all the CPUs by default
+        cache_size - max number of cached intermediates
+
+    Loads the dataset once and runs all the scenarios over it, see ScenarioRunner.
+    """
+    return ScenarioRunner(file_name, cache_size).run(scenarios, workers)
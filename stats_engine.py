@@ -0,0 +1,282 @@
+from typing import Dict, List, Tuple
+import numpy as np
+from instrumentation import incr
+
+# Upper bound for the number of elements in the temporary (symbols, months, months) arrays
+# used for the rank correlations. Symbols are processed in chunks so this is not exceeded.
+RANK_CHUNK_ELEMENTS = 2_000_000
+
+
+def period_returns(closes: np.ndarray) -> np.ndarray:
+    """
+    params:
+        closes - 2D array of closes, shape (symbols, periods + 1), eg. the month end closes
+
+    Simple arithmetic returns between the consecutive closes, shape (symbols, periods).
+    """
+    closes = np.asarray(closes, dtype=np.float64)
+    return closes[:, 1:] / closes[:, :-1] - 1
+
+
+def _window_starts(t: int, window: int = None) -> np.ndarray:
+    """ First position (included) of the window ending at every period, 0 for an expanding window """
+    ends = np.arange(1, t + 1)
+    return np.zeros(t, dtype=np.int64) if window is None else np.maximum(ends - window, 0)
+
+
+def _rolling_sum(xs: np.ndarray, window: int = None) -> np.ndarray:
+    """
+    Sum over the window ending at every period, along the last axis.
+    Every step is a single difference of 2 cumulative sums - O(1) per period, whatever the window size.
+    """
+    cs = np.concatenate([np.zeros(xs.shape[:-1] + (1,)), np.cumsum(xs, axis=-1)], axis=-1)
+    t = xs.shape[-1]
+    return cs[..., 1:] - cs[..., _window_starts(t, window)]
+
+
+def _first_valid(xs: np.ndarray) -> np.ndarray:
+    """ First non NaN value of every row, 0 for rows with nothing """
+    valid = ~np.isnan(xs)
+    first = np.take_along_axis(xs, valid.argmax(axis=-1)[..., None], axis=-1)
+    return np.where(valid.any(axis=-1, keepdims=True), first, 0.0)
+
+
+def rolling_moments(xs: np.ndarray, window: int = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    params:
+        xs - 2D array, shape (symbols, periods). Missing values are NaN and are not counted.
+        window - number of periods in the window, None for an expanding window
+
+    Count, mean and sample variance over the window ending at every period.
+    Variance is NaN where the count is < 2.
+    """
+    xs = np.asarray(xs, dtype=np.float64)
+    valid = ~np.isnan(xs)
+    # Shift by the first value to keep the sum of squares numerically stable.
+    # Variance is shift invariant, so this has no other effect.
+    first = _first_valid(xs)
+    shifted = np.where(valid, xs - first, 0.0)
+    n = _rolling_sum(valid.astype(np.float64), window)
+    s1 = _rolling_sum(shifted, window)
+    s2 = _rolling_sum(shifted * shifted, window)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        m = s1 / n
+        var = (s2 - n * m * m) / (n - 1)
+    var = np.where(n >= 2, np.maximum(var, 0.0), np.nan)
+    return n, m + first, var
+
+
+def _annualized_ratio(rm: np.ndarray, s: np.ndarray, p: np.ndarray) -> np.ndarray:
+    """
+    params:
+        rm - mean (excess) returns
+        s - standard deviations
+        p - number of periods behind every value
+
+    Same as in returns_statistics - annualize only if the period is > 1 Year. Undefined ratios are 0.
+    """
+    annual = p > 12
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rm = np.where(annual, (1 + rm) ** (12 / p) - 1, rm)
+        s = np.where(annual, s * np.sqrt(12), s)
+        ratio = rm / s
+    return np.where(np.isfinite(ratio) & (s > 0), ratio, 0.0)
+
+
+def expanding_sharpe(returns: np.ndarray, RFR: np.ndarray = None) -> np.ndarray:
+    """
+    params:
+        returns - 2D array of returns, shape (symbols, periods)
+        RFR - optional risk free rate per period, shape (periods,) or the shape of the returns
+
+    Sharpe Ratio of every symbol as of every period, over all the returns up to it.
+    Gives the same results as sharpe_ratio(xs[:t + 1], t + 1), with 0 where that raises.
+    """
+    returns = np.asarray(returns, dtype=np.float64)
+    excess = returns if RFR is None else returns - np.broadcast_to(RFR, returns.shape)
+    # Deviation of the excess returns - the same as of the returns, unless the RFR changes over time
+    n, rm, var = rolling_moments(excess)
+    return _annualized_ratio(rm, np.sqrt(var), n)
+
+
+def expanding_sortino(returns: np.ndarray, MAR: float = 0.0) -> np.ndarray:
+    """
+    params:
+        returns - 2D array of returns, shape (symbols, periods)
+        MAR - minimum acceptance return
+
+    Sortino Ratio of every symbol as of every period, over all the returns up to it.
+    Gives the same results as sortino_ratio(xs[:t + 1], t + 1, MAR), with 0 where that raises.
+    """
+    returns = np.asarray(returns, dtype=np.float64)
+    p = np.broadcast_to(np.arange(1, returns.shape[1] + 1), returns.shape)
+    # Only the returns below MAR are counted for the downside deviation
+    _, m, var = rolling_moments(np.where(returns < MAR, returns, np.nan))
+    return _annualized_ratio(m - MAR, np.sqrt(var), p)
+
+
+def _expanding_ranks(xs: np.ndarray) -> np.ndarray:
+    """
+    params:
+        xs - 2D array, shape (symbols, periods)
+
+    Ranks (average method for ties) of every element within every expanding window.
+    Output shape is (symbols, periods, periods) - [k, i, t] is the rank of xs[k, i] among xs[k, :t + 1].
+    Only the elements with i <= t are meaningful.
+    """
+    less = (xs[:, None, :] < xs[:, :, None]).astype(np.float64)
+    ties = (xs[:, None, :] == xs[:, :, None]).astype(np.float64)
+    c = less + 0.5 * ties
+    # The element itself is not counted against itself
+    idx = np.arange(xs.shape[1])
+    c[:, idx, idx] = 0.0
+    return 1 + np.cumsum(c, axis=2)
+
+
+def expanding_rank_correlation(xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+    """
+    params:
+        xs - 2D array, shape (symbols, periods), eg. the returns
+        ys - 2D array with the same shape, eg. the market caps
+
+    Spearman rank correlation of every symbol as of every period, over all the values up to it.
+    Gives the same results as correlation(rankdata(xs[:t + 1]), rankdata(ys[:t + 1])), with 0 where that raises.
+    """
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    k, t = xs.shape
+    incr('rank_correlations', k * t)
+    result = np.zeros((k, t))
+    if t == 0:
+        return result
+
+    n = np.arange(1, t + 1)
+    window = np.arange(t)[:, None] <= np.arange(t)[None, :]
+    chunk = max(1, RANK_CHUNK_ELEMENTS // (t * t))
+
+    for lo in range(0, k, chunk):
+        hi = min(lo + chunk, k)
+        # The mean of the ranks is always (n + 1) / 2, ties included
+        rx = np.where(window, _expanding_ranks(xs[lo:hi]) - (n + 1) / 2, 0.0)
+        ry = np.where(window, _expanding_ranks(ys[lo:hi]) - (n + 1) / 2, 0.0)
+        sxy = (rx * ry).sum(axis=1)
+        sxx = (rx * rx).sum(axis=1)
+        syy = (ry * ry).sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            corr = sxy / np.sqrt(sxx * syy)
+        result[lo:hi] = np.where((sxx > 0) & (syy > 0) & (n >= 2), corr, 0.0)
+
+    return result
+
+
+def monthly_statistics(closes: np.ndarray,
+                       market_caps: np.ndarray,
+                       MAR: float = 0.0,
+                       RFR: np.ndarray = None) -> Dict[str, np.ndarray]:
+    """
+    params:
+        closes - 2D array of the month end closes, shape (symbols, months + 1)
+        market_caps - 2D array of the month end market caps, same shape
+        MAR - minimum acceptance return for the Sortino Ratio
+        RFR - optional risk free rate per month for the Sharpe Ratio
+
+    Computes all the monthly statistics at once for the whole symbols x months matrix.
+    Every output array has shape (symbols, months):
+        returns - 1M returns
+        sharpe - Sharpe Ratio over the returns up to that month
+        sortino - Sortino Ratio over the returns up to that month
+        rank_corr - Rank correlation coefficient of the market cap vs. the return up to that month
+    """
+    returns = period_returns(closes)
+    market_caps = np.asarray(market_caps, dtype=np.float64)[:, 1:]
+
+    return {
+        'returns': returns,
+        'sharpe': expanding_sharpe(returns, RFR),
+        'sortino': expanding_sortino(returns, MAR),
+        'rank_corr': expanding_rank_correlation(returns, market_caps)
+    }
+
+
+def standardize(returns: np.ndarray) -> np.ndarray:
+    """
+    params:
+        returns - 2D array of returns, shape (symbols, periods)
+
+    De-meaned returns scaled to unit norm, so that the correlation of 2 symbols is the dot product of their rows.
+    Rows with no variation (or less than 2 periods) are all 0, ie. they have 0 correlation with everything,
+    same as math_helpers.correlation.
+    """
+    returns = np.asarray(returns, dtype=np.float64)
+    if returns.shape[1] < 2:
+        return np.zeros(returns.shape)
+    centered = returns - returns.mean(axis=1, keepdims=True)
+    norms = np.sqrt((centered * centered).sum(axis=1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(norms[:, None] > 0, centered / norms[:, None], 0.0)
+
+
+def correlation_matrix(returns: np.ndarray) -> np.ndarray:
+    """
+    params:
+        returns - 2D array of returns, shape (symbols, periods)
+
+    Full N x N Pearson correlation matrix of the symbols' returns in one pass -
+    the returns are standardized once and multiplied by their transpose.
+    Same as correlation(xs, ys) for every pair, including 0 where there is no variation or less than 2 periods.
+    """
+    returns = np.asarray(returns, dtype=np.float64)
+    k, t = returns.shape
+    incr('correlation_matrices')
+    incr('correlation_pairs', k * (k - 1) // 2)
+    if t < 2:
+        return np.zeros((k, k))
+
+    z = standardize(returns)
+    return z @ z.T
+
+
+def top_positions(values: np.ndarray, k: int) -> np.ndarray:
+    """
+    params:
+        values - 1D array, eg. the packed upper triangle of a correlation matrix
+        k - number of positions to return
+
+    Positions of the k largest values, sorted by descending value. Equal values keep their order in the array.
+    """
+    if k < len(values):
+        # Partial selection first, then keep all above the k-th value and the first of the ones equal to it
+        kth = np.partition(values, len(values) - k)[len(values) - k]
+        above = np.flatnonzero(values > kth)
+        equal = np.flatnonzero(values == kth)[:k - len(above)]
+        selected = np.concatenate([above, equal])
+    else:
+        selected = np.arange(len(values))
+    return selected[np.lexsort((selected, -values[selected]))]
+
+
+def top_correlated_pairs(corr: np.ndarray, symbols: List[str], k: int = 1) -> List[list]:
+    """
+    params:
+        corr - correlation matrix, shape (symbols, symbols)
+        symbols - cryptocurrency tickers in the same order as in the matrix
+        k - number of pairs to return
+
+    The top k most correlated distinct pairs, in the format [["A,B", corr], ...], sorted by descending correlation.
+    Pairs with equal correlations keep the order of itertools.combinations(symbols, 2).
+    """
+    i, j = np.triu_indices(len(symbols), 1)
+    values = corr[i, j]
+    return [[f'{symbols[i[p]]},{symbols[j[p]]}', float(values[p])] for p in top_positions(values, k)]
+
+
+def pair_correlations(corr: np.ndarray, symbols: List[str]) -> List[list]:
+    """
+    params:
+        corr - correlation matrix, shape (symbols, symbols)
+        symbols - cryptocurrency tickers in the same order as in the matrix
+
+    All distinct pairs in the format [["A,B", corr], ...], in the order of itertools.combinations(symbols, 2).
+    """
+    i, j = np.triu_indices(len(symbols), 1)
+    return [[f'{symbols[a]},{symbols[b]}', c] for a, b, c in zip(i.tolist(), j.tolist(), corr[i, j].tolist())]